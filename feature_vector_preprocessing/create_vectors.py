@@ -1,16 +1,27 @@
 '''
 A script that creates training and test vectors from several directories of documents based on a given percentage split.
-Command to run: create_vectors.py train_vector_file test_vector_file ratio dir1 dir2...etc
+Command to run: create_vectors.py train_vector_file test_vector_file ratio dir1 dir2...etc [--procs N]
+[--format text|svmlight|npz] [--hash-bits k]
 
 takes the percent given of the articles in the given directories and creates training data vectors with proc_file.py
 also creates the train ones
+
+Each vector line is written as soon as its file is processed, so memory doesn't grow with the corpus. With --procs the
+files are processed by a pool of worker processes; imap hands the lines back in file order, so the output is the same
+as with one process.
+--format svmlight or npz writes numbered features (and sidecar files of the words and labels) instead of the text
+format, see sparse_vectors.py.
+--hash-bits k uses the hashing trick of proc_file.py: the features are 2^k signed buckets instead of the words, so the
+vectors have a fixed width and no vocabulary is built.
 '''
 
 import sys
 import os
+import argparse
+from multiprocessing import Pool
+
 import proc_file
-import subprocess
-import re
+from sparse_vectors import FORMATS, Vocabulary, HashedColumns, SVMLightWriter, CSRWriter, remove_files
 
 def get_dir_basename(path):
     '''
@@ -20,7 +31,7 @@ def get_dir_basename(path):
     return path.split('/')[-1]
 
 def test_train_split(files, ratio):
-    num_files = int(len(filenames))
+    num_files = len(files)
     train_num = round(num_files * ratio)
     if train_num == num_files:
         train_num -= 1
@@ -45,38 +56,119 @@ def format_output(input_filename, target_label, fv_counter):
     return output_data
 
 
-
-
-if __name__ == "__main__":
-    train_output_filename, test_output_filename = sys.argv[1], sys.argv[2]
-    ratio = float(sys.argv[3])
-    #grabs all given directories
-    directories = sys.argv[4:]
-    non_alpha = re.compile('[^A-Za-z]+')
-    train_output_list, test_output_list = [], []
+def vector_jobs(directories, ratio, hash_bits=None):
+    '''
+    :param directories: list of class directories
+    :return: list of (is_train, filepath, filename, class_label, hash_bits), train and test files of each directory in
+    order
+    '''
+    jobs = []
     for path in directories:
-    #The first % ratio in each directory is training files, the rest is test files
+        #The first % ratio in each directory is training files, the rest is test files
         class_label = get_dir_basename(path)
-        filenames = sorted(os.listdir(path))
-        train_filenames, test_filenames = test_train_split(filenames, ratio)
+        train_filenames, test_filenames = test_train_split(sorted(os.listdir(path)), ratio)
+        for is_train, filenames in ((True, train_filenames), (False, test_filenames)):
+            jobs.extend((is_train, '{}/{}'.format(path, file), file, class_label, hash_bits) for file in filenames)
+    return jobs
 
-        #for all files in train set, process data and then format output
-        # for all files in test set, do same
-        for file in train_filenames:
-            full_filepath = '{}/{}'.format(path, file)
-            feature_vector_data = proc_file.process_file(full_filepath)
-            train_output_list.append(format_output(file, class_label, feature_vector_data))
+def vector_line(job):
+    #process data and then format output. A top level function so that pool workers can run it
+    is_train, filepath, filename, class_label, hash_bits = job
+    return is_train, format_output(filename, class_label, proc_file.process_file(filepath, hash_bits))
 
-        for file in test_filenames:
-            full_filepath = '{}/{}'.format(path, file)
-            feature_vector_data = proc_file.process_file(full_filepath)
-            test_output_list.append(format_output(file, class_label, feature_vector_data))
+def vector_counts(job):
+    #for the numbered formats the words get their ids in the main process, so the workers just count
+    is_train, filepath, filename, class_label, hash_bits = job
+    return is_train, (filename, class_label, proc_file.process_file(filepath, hash_bits))
 
-    #write outputs
-    with open(train_output_filename, 'w') as tr_outfile:
-        tr_outfile.write('\n'.join(train_output_list))
-    with open(test_output_filename, 'w') as te_outfile:
-        te_outfile.write('\n'.join(test_output_list))
+def hash_bits_arg(value):
+    #argparse type of --hash-bits
+    hash_bits = int(value)
+    try:
+        proc_file.check_hash_bits(hash_bits)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+    return hash_bits
 
+class TextWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.outfile = open(filename, 'w')
+        self.num_lines = 0
+        self.closed = False
 
-    
\ No newline at end of file
+    def write(self, line):
+        #lines are separated by newlines, with none after the last (like the '\n'.join this replaced)
+        self.outfile.write('\n' + line if self.num_lines else line)
+        self.num_lines += 1
+
+    def close(self):
+        self.outfile.close()
+        self.closed = True
+
+    def abort(self):
+        #the baseline wrote nothing when a run failed, so neither does this
+        if not self.closed:
+            self.outfile.close()
+            remove_files([self.filename])
+
+def create_vectors(directories, ratio, train_output_filename, test_output_filename, procs=1, output_format='text',
+                   hash_bits=None, chunksize=16):
+    '''
+    Writes the train and test vector files, an instance at a time, in the same order as processing the files one by one.
+    :param procs: number of worker processes (1 processes the files in this process)
+    :param output_format: one of sparse_vectors.FORMATS. For svmlight and npz, train and test share the word ids
+    :param hash_bits: if given, the features are the 2^hash_bits buckets of proc_file.hash_features, not the words
+    '''
+    if hash_bits is not None:
+        #before any output file is opened
+        proc_file.check_hash_bits(hash_bits)
+    jobs = vector_jobs(directories, ratio, hash_bits)
+    if output_format == 'text':
+        make_writer = TextWriter
+        process = vector_line
+    else:
+        writer_class = SVMLightWriter if output_format == 'svmlight' else CSRWriter
+        vocab, labels = HashedColumns(hash_bits) if hash_bits is not None else Vocabulary(), Vocabulary()
+        make_writer = lambda filename: writer_class(filename, vocab, labels)
+        process = vector_counts
+    writers, pool = {}, None
+    try:
+        #opened in here, so if the test file can't be opened the train writer is aborted too
+        writers[True] = make_writer(train_output_filename)
+        writers[False] = make_writer(test_output_filename)
+        pool = Pool(procs) if procs > 1 else None
+        instances = pool.imap(process, jobs, chunksize) if pool else map(process, jobs)
+        for is_train, instance in instances:
+            if output_format == 'text':
+                writers[is_train].write(instance)
+            else:
+                writers[is_train].write(*instance)
+        #closed after everything is written, so both sidecars have the whole vocabulary
+        for writer in writers.values():
+            writer.close()
+    except BaseException:
+        #don't leave open files, temporary files or partial outputs behind (a writer that did close is kept)
+        for writer in writers.values():
+            writer.abort()
+        raise
+    finally:
+        #terminate rather than close, so after an error (or ^C) the rest of the jobs aren't run first
+        if pool:
+            pool.terminate()
+            pool.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Creates train and test vectors from directories of documents')
+    parser.add_argument('train_output_filename')
+    parser.add_argument('test_output_filename')
+    parser.add_argument('ratio', type=float)
+    #grabs all given directories
+    parser.add_argument('directories', nargs='+')
+    parser.add_argument('--procs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--format', choices=FORMATS, default='text', help='output format, see sparse_vectors.py')
+    parser.add_argument('--hash-bits', type=hash_bits_arg,
+                        help='hash the words into 2^k signed buckets, 1 <= k <= 31 (see proc_file.py)')
+    args = parser.parse_args()
+    create_vectors(args.directories, args.ratio, args.train_output_filename, args.test_output_filename, args.procs,
+                   args.format, args.hash_bits)
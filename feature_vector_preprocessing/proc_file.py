@@ -1,6 +1,6 @@
 '''
 A script that generates feature vectors from an input file.
-Command to run: proc_file.py input_file targetLabel output_file
+Command to run: proc_file.py input_file targetLabel output_file [hash_bits]
 
 input file:
 textfile of particular format
@@ -12,52 +12,71 @@ replaceall chars not [a-zA-Z] with whitespace and lowercase all chars
 tokenise by whitespace
 words are features, values or the freq in file of that word
 featname, val pairs are ordered by featname spelling
+
+with hash_bits k, the features are hashed (the hashing trick): each word goes to bucket crc32(word) mod 2^k, and the
+features are the bucket numbers 0..2^k-1 (in numeric order) instead of the words. The top bit of the crc32 is a sign,
+so a word adds +freq or -freq to its bucket and colliding words tend to cancel out rather than pile up. The width of a
+vector is then fixed at 2^k, and no vocabulary has to be kept or shared between processes
 '''
 
 import sys
+import zlib
 from collections import Counter
 
 import re
 
+WORD = re.compile('[A-Za-z]+')
+#the first blank (or whitespace only) line, which ends the header
+HEADER_END = re.compile(r'^[^\S\n]*$', re.M)
+
 
-def process_file(input_filename):
+def process_file(input_filename, hash_bits=None):
     '''
     A function that takes and input file and returns a counter of word freq pairs
+    The file is read in one go and tokenised with one regex pass over everything after the header, rather than a
+    substitution, lowercase and split per line (same tokens: runs of [A-Za-z], lowercased)
     :param input_filename: an input file of standard format (basically with a header to be skipped)
-    :param non_alpha: the regex to substitute with whitespace before tokenisation
-    :param output_filename:
-    :return: Counter of word freq pairs
+    :param hash_bits: if given, hash the words into 2^hash_bits signed buckets (see hash_features)
+    :return: Counter of word freq pairs (bucket: summed signed freq when hashing)
     '''
-    word_freq = Counter()
-    non_alpha = re.compile('[^A-Za-z]+')
-    with open(input_filename, 'rU') as infile:
-        start_reading = False
-        for line in infile:
-            # skip header
-            line = line.strip()
-            if start_reading:
-                line = non_alpha.sub(' ', line)
-                word_tokens = line.lower().split()
-                #once have a list of word tokens, add them to a counter
-                for token in word_tokens:
-                    if word_freq[token]:
-                        word_freq[token] += 1
-                    else:
-                        word_freq[token] = 1
-            else:
-                if not line:
-                    start_reading = True
-    return word_freq
-
-def main(input_filename, target_label, output_filename):
+    with open(input_filename, 'r') as infile:
+        text = infile.read()
+    # skip header
+    header_end = HEADER_END.search(text)
+    if not header_end:
+        return Counter()
+    word_freq = Counter(map(str.lower, WORD.findall(text, header_end.end())))
+    return hash_features(word_freq, hash_bits) if hash_bits is not None else word_freq
+
+def check_hash_bits(hash_bits):
+    #raises ValueError unless hash_bits is from 1 to 31 (the top bit of the crc32 is the sign)
+    if not 0 < hash_bits <= 31:
+        raise ValueError('hash_bits must be from 1 to 31, not {}'.format(hash_bits))
+
+def hash_features(word_freq, hash_bits):
+    '''
+    :param word_freq: Counter of word freq pairs
+    :param hash_bits: number of bits of the crc32 used for the bucket, at most 31 (the top bit is the sign)
+    :return: Counter of bucket: signed freq. Buckets where collisions cancelled out to 0 are left out
+    '''
+    check_hash_bits(hash_bits)
+    mask = (1 << hash_bits) - 1
+    bucket_freq = Counter()
+    for word, freq in word_freq.items():
+        word_hash = zlib.crc32(word.encode('utf-8'))
+        bucket_freq[word_hash & mask] += -freq if word_hash >> 31 else freq
+    return Counter({bucket: freq for bucket, freq in bucket_freq.items() if freq})
+
+def main(input_filename, target_label, output_filename, hash_bits=None):
     '''
     :param input_filename: name of textfile of particular format
     :param target_label: the class label of the feature vector set
     :param output_filename: the filename to write to
+    :param hash_bits: if given, the features are hashed into 2^hash_bits buckets
     :return: none - writes file
     '''
 
-    feature_vector_data = process_file(input_filename)
+    feature_vector_data = process_file(input_filename, hash_bits)
     feature_vlist = ' '.join(["{} {}".format(key, val) for key, val in sorted(feature_vector_data.items())])
     output_data = "{} {} {}".format(input_filename, target_label, feature_vlist)
     with open(output_filename, 'w') as outfile:
@@ -65,7 +84,13 @@ def main(input_filename, target_label, output_filename):
 
 if __name__ == "__main__":
     input_filename, target_label, output_filename = sys.argv[1], sys.argv[2], sys.argv[3]
-    main(input_filename, target_label, output_filename)
+    hash_bits = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    if hash_bits is not None:
+        try:
+            check_hash_bits(hash_bits)
+        except ValueError as error:
+            sys.exit(str(error))
+    main(input_filename, target_label, output_filename, hash_bits)
 
 
 
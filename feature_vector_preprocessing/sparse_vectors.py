@@ -0,0 +1,206 @@
+'''
+Writers for the outputs of create_vectors.py, and a loader for the CSR one.
+
+The text format (instanceName label f1 v1 f2 v2...) has to be parsed again by everything that reads it. The other
+formats number the words (a column id per word, in the order they are first seen, see Vocabulary) and the labels:
+- svmlight: one line per instance, "label_id id:value id:value... # instanceName", ids ascending and 1 based (as
+svm_light and svm_multiclass want)
+- npz: a CSR matrix, as an uncompressed numpy .npz holding indptr (int64), indices (int32), data (float64), labels
+(int32, the label id of each row) and shape. load_csr memory maps the arrays straight out of the .npz, so a training
+run doesn't read (or parse) the features until it uses them
+
+Every format is written an instance at a time. For npz the indices and data go to temporary files as they come, and
+are copied into the .npz (which needs to know their lengths up front) when the writer is closed. If the run fails the
+writers are aborted instead, which closes their files and removes the temporary ones and the partial outputs.
+The words, labels and instance names go in sidecar files next to the output, one per line, line i for id i:
+output.vocab, output.labels and output.names
+With hashed features (create_vectors.py --hash-bits) the ids are the buckets and there is no .vocab.
+'''
+
+import os
+import struct
+import zipfile
+from array import array
+
+import numpy as np
+
+BLOCK_SIZE = 1 << 20
+FORMATS = ['text', 'svmlight', 'npz']
+
+
+class Vocabulary:
+    #interns words (or labels) to ids, in the order they are first seen
+    def __init__(self):
+        self.word2id = {}
+        self.words = []
+
+    def __len__(self):
+        return len(self.words)
+
+    def intern(self, word):
+        word_id = self.word2id.get(word)
+        if word_id is None:
+            word_id = self.word2id[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def sorted_ids(self, fv_counter):
+        #:return: list of (id, value) of a counter of word:freq, by id
+        return sorted((self.intern(word), val) for word, val in fv_counter.items())
+
+
+class HashedColumns:
+    #stands in for a Vocabulary when the features are already hashed to buckets (proc_file.hash_features)
+    def __init__(self, hash_bits):
+        self.num_columns = 1 << hash_bits
+        self.words = None #there is no vocabulary, so no .vocab sidecar
+
+    def __len__(self):
+        return self.num_columns
+
+    def sorted_ids(self, fv_counter):
+        return sorted(fv_counter.items())
+
+
+def write_lines(filename, lines):
+    with open(filename, 'w') as outfile:
+        outfile.writelines(line + '\n' for line in lines)
+
+
+def remove_files(filenames):
+    #removes the ones that exist
+    for filename in filenames:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def read_lines(filename):
+    with open(filename, 'r') as infile:
+        return infile.read().split('\n')[:-1]
+
+
+class SVMLightWriter:
+    def __init__(self, filename, vocab, labels):
+        '''
+        :param vocab: Vocabulary of the words, which can be shared with other writers so train and test agree on ids
+        :param labels: Vocabulary of the labels, likewise
+        '''
+        self.filename, self.vocab, self.labels = filename, vocab, labels
+        self.outfile = open(filename, 'w')
+        self.closed = False
+
+    def write(self, input_filename, target_label, fv_counter):
+        parts = [str(self.labels.intern(target_label)+1)]
+        parts.extend('{}:{}'.format(word_id+1, val) for word_id, val in self.vocab.sorted_ids(fv_counter))
+        parts.extend(['#', input_filename])
+        self.outfile.write(' '.join(parts) + '\n')
+
+    def close(self):
+        self.outfile.close()
+        if self.vocab.words is not None:
+            write_lines(self.filename + '.vocab', self.vocab.words)
+        write_lines(self.filename + '.labels', self.labels.words)
+        self.closed = True
+
+    def abort(self):
+        #after a failed run (or close): removes the partial output, so it can't pass for a finished one
+        if self.closed:
+            return
+        self.outfile.close()
+        remove_files([self.filename, self.filename + '.vocab', self.filename + '.labels'])
+
+
+class CSRWriter:
+    def __init__(self, filename, vocab, labels):
+        self.filename, self.vocab, self.labels = filename, vocab, labels
+        temp_suffix = '.{}.tmp'.format(os.getpid())
+        self.indices_file, self.data_file = filename + '.indices' + temp_suffix, filename + '.data' + temp_suffix
+        self.indices_out, self.data_out = open(self.indices_file, 'wb'), open(self.data_file, 'wb')
+        self.names_out = open(filename + '.names', 'w')
+        self.temp_file = '{}.{}.tmp'.format(filename, os.getpid())
+        self.indptr = array('q', [0])
+        self.row_labels = array('i')
+        self.closed = False
+
+    def write(self, input_filename, target_label, fv_counter):
+        features = self.vocab.sorted_ids(fv_counter)
+        array('i', (word_id for word_id, val in features)).tofile(self.indices_out)
+        array('d', (val for word_id, val in features)).tofile(self.data_out)
+        self.indptr.append(self.indptr[-1] + len(features))
+        self.row_labels.append(self.labels.intern(target_label))
+        self.names_out.write(input_filename + '\n')
+
+    def close(self):
+        for outfile in (self.indices_out, self.data_out, self.names_out):
+            outfile.close()
+        num_values = self.indptr[-1]
+        shape = np.array([len(self.row_labels), len(self.vocab)], dtype=np.int64)
+        #write then rename, so a reader never maps half a file
+        with zipfile.ZipFile(self.temp_file, 'w', zipfile.ZIP_STORED, allowZip64=True) as npz:
+            write_member(npz, 'indptr', np.dtype(np.int64), len(self.indptr), blocks=[self.indptr.tobytes()])
+            write_member(npz, 'indices', np.dtype(np.int32), num_values, filename=self.indices_file)
+            write_member(npz, 'data', np.dtype(np.float64), num_values, filename=self.data_file)
+            write_member(npz, 'labels', np.dtype(np.int32), len(self.row_labels), blocks=[self.row_labels.tobytes()])
+            write_member(npz, 'shape', shape.dtype, 2, blocks=[shape.tobytes()])
+        os.replace(self.temp_file, self.filename)
+        os.remove(self.indices_file)
+        os.remove(self.data_file)
+        if self.vocab.words is not None:
+            write_lines(self.filename + '.vocab', self.vocab.words)
+        write_lines(self.filename + '.labels', self.labels.words)
+        self.closed = True
+
+    def abort(self):
+        #after a failed run (or close): removes the temporary files and the .names of the unfinished output
+        if self.closed:
+            return
+        for outfile in (self.indices_out, self.data_out, self.names_out):
+            outfile.close()
+        remove_files([self.indices_file, self.data_file, self.temp_file, self.filename + '.names'])
+
+
+def write_member(npz, name, dtype, length, blocks=None, filename=None):
+    '''
+    Writes a 1D array into the .npz as name.npy, a block at a time.
+    :param blocks: list of bytes of the array, or
+    :param filename: a raw file of the array (native byte order, as written by array.tofile)
+    '''
+    with npz.open(name + '.npy', 'w', force_zip64=True) as member:
+        np.lib.format.write_array_header_1_0(member, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                      'fortran_order': False, 'shape': (length,)})
+        if filename is not None:
+            with open(filename, 'rb') as infile:
+                for block in iter(lambda: infile.read(BLOCK_SIZE), b''):
+                    member.write(block)
+        for block in blocks or []:
+            member.write(block)
+
+
+def load_csr(filename, mmap=True):
+    '''
+    Loads a CSR matrix written by CSRWriter.
+    :param mmap: memory map the arrays (they are stored uncompressed in the .npz) rather than reading them
+    :return: indptr, indices, data, labels numpy arrays and the (rows, columns) shape
+    '''
+    if not mmap:
+        with np.load(filename) as csr_data:
+            arrays = {name: csr_data[name] for name in ('indptr', 'indices', 'data', 'labels', 'shape')}
+    else:
+        arrays = {}
+        with zipfile.ZipFile(filename) as npz, open(filename, 'rb') as infile:
+            for info in npz.infolist():
+                if info.compress_type != zipfile.ZIP_STORED:
+                    raise ValueError('{} in {} is compressed, so it can not be memory mapped'.format(
+                        info.filename, filename))
+                #the member's data starts after its local file header (30 bytes, then the name and extra fields)
+                infile.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack('<HH', infile.read(4))
+                infile.seek(info.header_offset + 30 + name_length + extra_length)
+                version = np.lib.format.read_magic(infile)
+                read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0) else
+                               np.lib.format.read_array_header_2_0)
+                shape, fortran_order, dtype = read_header(infile)
+                arrays[info.filename[:-len('.npy')]] = np.memmap(filename, dtype=dtype, mode='r', shape=shape,
+                                                                 offset=infile.tell())
+    shape = tuple(int(n) for n in arrays['shape'])
+    return arrays['indptr'], arrays['indices'], arrays['data'], arrays['labels'], shape
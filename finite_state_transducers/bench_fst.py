@@ -0,0 +1,90 @@
+'''
+Throughput of dijkstra_viterbi (fst_acceptor2.py) against the compiled FST (compiled_fst.py) on a carmel FST.
+
+Command to run: bench_fst.py fst_file input_file [--repeat N]
+or: bench_fst.py --random STATES ARCS SYMBOLS LENGTH [fst_file input_file] [--lines N] [--repeat N]
+
+The second form writes a random carmel FST (STATES states, ARCS arcs per state over SYMBOLS input symbols) and LENGTH
+symbol input lines, and times those. They go to fst_file and input_file if given (and are kept), otherwise to a
+temporary directory that is removed afterwards. Every input line is decoded by both (the
+whole file, repeat times) and the outputs are checked to be the same.
+'''
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+from fst_acceptor2 import Graph, dijkstra_viterbi, strip_carmel_fst_file, skip_pycomments
+from compiled_fst import CompiledFST
+
+
+def write_random_fst(fst_file, input_file, num_states, arcs_per_state, num_symbols, length, num_lines, seed=0):
+    rng = random.Random(seed)
+    symbols = ['s{}'.format(i) for i in range(num_symbols)]
+    with open(fst_file, 'w') as outfile:
+        outfile.write('Q{}\n'.format(num_states-1))
+        for state in range(num_states):
+            for _ in range(arcs_per_state):
+                outfile.write('(Q{} (Q{} "{}" "{}" {:.4f}))\n'.format(state, rng.randrange(num_states),
+                                                                       rng.choice(symbols), rng.choice(symbols),
+                                                                       rng.random()))
+    with open(input_file, 'w') as outfile:
+        for _ in range(num_lines):
+            outfile.write(' '.join('"{}"'.format(rng.choice(symbols)) for _ in range(length)) + '\n')
+
+
+def time_decoder(decode, inputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [decode(symbols) for symbols in inputs]
+    return time.perf_counter() - start, results
+
+
+def run_benchmark(fst_file, input_file, repeat):
+    #times both decoders on every line of input_file and checks that they agree
+    with open(input_file, 'r') as file:
+        inputs = [re.sub('"', '', line).strip().split() for line in skip_pycomments(file)]
+    graph_data = strip_carmel_fst_file(fst_file)
+
+    def dict_decode(symbols):
+        result, prob = dijkstra_viterbi(symbols, Graph(*graph_data))
+        return (result[::-1] if isinstance(result, list) else None), prob
+
+    start = time.perf_counter()
+    fst = CompiledFST.compile(*graph_data)
+    compile_time = time.perf_counter() - start
+    print(fst)
+    dict_time, dict_results = time_decoder(dict_decode, inputs, repeat)
+    compiled_time, compiled_results = time_decoder(fst.decode, inputs, repeat)
+    num_lines = len(inputs)*repeat
+    print('dijkstra_viterbi: {:.3f}s ({:.0f} lines/s)'.format(dict_time, num_lines/dict_time))
+    print('compiled: {:.3f}s ({:.0f} lines/s), compile {:.3f}s'.format(compiled_time, num_lines/compiled_time,
+                                                                     compile_time))
+    if dict_results != compiled_results:
+        sys.exit('Outputs differ')
+    print('Outputs are the same')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares dijkstra_viterbi with the compiled FST decoder')
+    parser.add_argument('fst_file', nargs='?')
+    parser.add_argument('input_file', nargs='?')
+    parser.add_argument('--random', type=int, nargs=4, metavar=('STATES', 'ARCS', 'SYMBOLS', 'LENGTH'))
+    parser.add_argument('--lines', type=int, default=100, help='number of random input lines')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+    if args.random:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if not args.input_file:
+                args.fst_file = os.path.join(temp_dir, 'bench_random.fst')
+                args.input_file = os.path.join(temp_dir, 'bench_random.ex')
+            write_random_fst(args.fst_file, args.input_file, *args.random, args.lines)
+            run_benchmark(args.fst_file, args.input_file, args.repeat)
+    elif not args.input_file:
+        parser.error('give fst_file and input_file, or --random')
+    else:
+        run_benchmark(args.fst_file, args.input_file, args.repeat)
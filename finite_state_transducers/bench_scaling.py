@@ -0,0 +1,104 @@
+'''
+How decoding time grows with input length on a dense random FST.
+
+Command to run: bench_scaling.py [--states N] [--arcs N] [--symbols N] [--lengths 2 4 8 ...] [--lines N]
+                                 [--baseline-cap SECONDS]
+
+With many arcs per state on each symbol, nearly every state is reachable at every index. A decoder that expands each
+(state, index) once grows linearly with the input length; the old queue based dijkstra_viterbi (which expanded a state
+again for every arc that reached it) grows exponentially. Times are per input line, for the old decoder (queue_viterbi
+below, the baseline), dijkstra_viterbi and compiled_fst.CompiledFST.decode.
+The baseline is stopped once it has run for --baseline-cap seconds on a length, and is not run on longer lengths after
+that ("-" in the table).
+The random FST and inputs are written to a temporary directory that is removed at the end.
+'''
+
+import os
+import re
+import time
+import argparse
+import tempfile
+from collections import defaultdict, deque
+
+from fst_acceptor2 import Graph, dijkstra_viterbi, strip_carmel_fst_file, skip_pycomments
+from compiled_fst import CompiledFST
+from bench_fst import write_random_fst
+
+
+def queue_viterbi(input, initial, final, transitions, deadline=None):
+    '''
+    The decoder dijkstra_viterbi replaced, kept as the baseline: a FIFO queue of (state, index) where every arc that
+    reaches a state pushes it again, so it is expanded once per path rather than once per index.
+    :param transitions: as from strip_carmel_fst_file
+    :param deadline: time.perf_counter() value to give up at
+    :return: list of outputs (last first) and probability, ('*none*', 0) if not accepted, or None past the deadline
+    '''
+    #{state: {index: (previous state, output, probability)}}
+    state_table = defaultdict(dict)
+    state_table[initial][0] = ('**', '**', 1)
+    search_states = deque([(initial, 0)])
+    while search_states:
+        if deadline is not None and time.perf_counter() > deadline:
+            return None
+        state, index = search_states.popleft()
+        if state == final and index == len(input):
+            final_output = []
+            while state_table[state][index][0] != '**':
+                state, output = state_table[state][index][:2]
+                final_output.append(output)
+                index -= 1
+            return final_output, state_table[final][len(input)][2]
+        if index == len(input):
+            continue
+        neighbours = transitions.get(state, {}).get(input[index], {})
+        prev_prob = state_table[state][index][2]
+        for (next_state, output), prob in sorted(neighbours.items(), key=lambda item: item[1], reverse=True):
+            predecessor = (state, output, prob*prev_prob)
+            current = state_table[next_state].get(index+1)
+            if current is None or predecessor[2] > current[2]:
+                state_table[next_state][index+1] = predecessor
+            search_states.append((next_state, index+1))
+    return '*none*', 0
+
+
+def time_lines(decode, inputs):
+    #:return: ms per line, or None if decode gave up
+    start = time.perf_counter()
+    for symbols in inputs:
+        if decode(symbols) is None:
+            return None
+    return 1000*(time.perf_counter() - start)/len(inputs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Decoding time against input length')
+    parser.add_argument('--states', type=int, default=20)
+    parser.add_argument('--arcs', type=int, default=60, help='arcs per state')
+    parser.add_argument('--symbols', type=int, default=3, help='number of input (and output) symbols')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[2, 4, 8, 16, 32, 64, 128, 256])
+    parser.add_argument('--lines', type=int, default=20, help='input lines per length')
+    parser.add_argument('--baseline-cap', type=float, default=10,
+                        help='seconds the old decoder may take on one length before it is dropped')
+    args = parser.parse_args()
+
+    print('length\tqueue_viterbi ms/line\tdijkstra_viterbi ms/line\tcompiled ms/line')
+    run_baseline = True
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fst_file, input_file = os.path.join(temp_dir, 'bench_scaling.fst'), os.path.join(temp_dir, 'bench_scaling.ex')
+        for length in args.lengths:
+            #the same seed gives the same FST for every length
+            write_random_fst(fst_file, input_file, args.states, args.arcs, args.symbols, length, args.lines)
+            graph_data = strip_carmel_fst_file(fst_file)
+            fst = CompiledFST.compile(*graph_data)
+            with open(input_file, 'r') as file:
+                inputs = [re.sub('"', '', line).strip().split() for line in skip_pycomments(file)]
+            baseline_time = None
+            if run_baseline:
+                deadline = time.perf_counter() + args.baseline_cap
+                baseline_time = time_lines(lambda symbols: queue_viterbi(symbols, *graph_data, deadline=deadline),
+                                           inputs)
+                run_baseline = baseline_time is not None
+            dict_time = time_lines(lambda symbols: dijkstra_viterbi(symbols, Graph(*graph_data)), inputs)
+            compiled_time = time_lines(fst.decode, inputs)
+            print('{}\t{}\t{:.3f}\t{:.3f}'.format(length, '-' if baseline_time is None else '{:.3f}'.format(baseline_time),
+                                                  dict_time, compiled_time))
@@ -0,0 +1,91 @@
+'''
+A streaming reader for carmel format FSA/FST files, shared by fst_acceptor2.py, compiled_fst.py and the
+morphological_fsm scripts.
+
+The format: the first line is the final state, then one arc per line, e.g.
+(S (T "in" "out" 0.4))  FST arc with a weight
+(S (T in out))          FST arc, weight 1
+(q0 (q3 label))         FSA arc
+The start state is the first state of the first arc. Lines starting with # are comments.
+
+The old readers replaced the parens and then the quotes with two re.sub passes per line, after reading the whole file
+into a list, so a quoted symbol containing a space, a paren or an escaped quote was split or mangled. Here each line is
+tokenized with one regex findall: parens, quoted symbols (with \\" escapes, kept whole) and bare tokens. Only an unquoted
+token can be a weight, so "0.4" is a symbol and 0.4 is a weight.
+'''
+
+import re
+
+#a lone " only matches when a quoted symbol isn't closed
+TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[^\s()"]+|[()]|"')
+UNESCAPE_RE = re.compile(r'\\(.)')
+
+
+def unquote(token):
+    if token[0] != '"':
+        return token
+    if len(token) == 1:
+        raise ValueError('Unclosed quote')
+    token = token[1:-1]
+    return UNESCAPE_RE.sub(r'\1', token) if '\\' in token else token
+
+
+def tokenize(line):
+    '''
+    :param line: one line of a carmel file
+    :return: list of (token, quoted) tuples. Parens are returned as '(' and ')' with quoted False
+    '''
+    try:
+        return [(unquote(token), token[0] == '"') for token in TOKEN_RE.findall(line)]
+    except ValueError:
+        raise ValueError('Unclosed quote: {}'.format(line.strip()))
+
+
+def parse_arc(line, arity):
+    '''
+    :param line: an arc line, (state (next_state symbol1 .. symbol_arity [weight]))
+    :param arity: number of symbols on an arc, 1 for an FSA and 2 (input and output) for an FST
+    :return: state, next state, list of symbols, weight (None if the arc has no weight)
+    '''
+    #this runs once per arc, so it works on the raw findall strings rather than tokenize's tuples
+    tokens = TOKEN_RE.findall(line)
+    labels = tokens[4:-2]
+    if (len(tokens) < 6 or tokens[0] != '(' or tokens[2] != '(' or tokens[-1] != ')' or tokens[-2] != ')'
+            or tokens[1] in '()"' or tokens[3] in '()"' or '(' in labels or ')' in labels or '"' in labels):
+        raise ValueError('Invalid carmel arc: {}'.format(line.strip()))
+    weight = None
+    if len(labels) == arity+1 and labels[-1][0] != '"':
+        try:
+            weight = float(labels[-1])
+        except ValueError:
+            raise ValueError('Invalid weight {} on arc: {}'.format(labels[-1], line.strip()))
+        labels = labels[:-1]
+    if len(labels) != arity:
+        raise ValueError('Expected {} symbols on arc: {}'.format(arity, line.strip()))
+    try:
+        return unquote(tokens[1]), unquote(tokens[3]), [unquote(token) for token in labels], weight
+    except ValueError:
+        raise ValueError('Unclosed quote: {}'.format(line.strip()))
+
+
+def skip_comments(lines):
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def read_carmel(input_file, arity):
+    '''
+    Streams a carmel file, one line at a time.
+    :param arity: see parse_arc
+    :return: generator that yields the final state first, then (state, next state, symbols, weight) for each arc
+    '''
+    with open(input_file, 'r') as infile:
+        lines = skip_comments(infile)
+        final_line = next(lines, None)
+        if final_line is None:
+            raise ValueError('Empty carmel file {}'.format(input_file))
+        yield tokenize(final_line)[0][0]
+        for line in lines:
+            yield parse_arc(line, arity)
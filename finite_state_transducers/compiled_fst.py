@@ -0,0 +1,391 @@
+'''
+A compiled (array based) version of the FST used by fst_acceptor2.py.
+
+dijkstra_viterbi looks transitions up in the three level dict from strip_carmel_fst_file with string keys, sorts the
+neighbours on every expansion, keeps its state table in dicts keyed by Node objects, and queues a state again for every
+arc that reaches it (so the same (state, index) is expanded many times). Here the FST is compiled once:
+- states and symbols (input and output) get integer ids
+- the arcs are stored CSR style: the arcs of state s are arc_offsets[s]:arc_offsets[s+1], sorted by input symbol id
+(and by descending probability within a symbol, the order dijkstra_viterbi tries them in), so the arcs of a state on an
+input symbol are a contiguous slice found by binary search
+- the arc probabilities are converted to floats once
+
+decode then runs Viterbi a time step at a time over the array of states active at that step, expanding each state once
+(plus the epsilon closure of each step). It gives the same outputs and probabilities as dijkstra_viterbi (including
+which path wins a tie).
+
+Command to run: compiled_fst.py fst_file input_file
+or: compiled_fst.py --save fst_file compiled_file.cfst
+fst_file can be a carmel file or a .cfst file written by --save (CompiledFST.save), which loads without parsing.
+Prints the same lines as fst_acceptor2.py. bench_fst.py compares the throughput of the two.
+BatchDecoder decodes line after line with scratch arrays that are reused between lines (fst_acceptor2.py uses it).
+'''
+
+import re
+import sys
+import math
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import heapify, heappush, heappop
+
+from fst_acceptor2 import EPSILON, INVALID_FST, skip_pycomments
+from carmel_format import read_carmel
+
+BINARY_MAGIC = b'CFST1\n'
+BINARY_SUFFIX = '.cfst'
+
+
+def to_cost(prob):
+    return -math.log(prob) if prob > 0 else math.inf
+
+
+class CompiledFST:
+    def __init__(self, states, symbols, initial, final, arc_offsets, arc_inputs, arc_next, arc_outputs, arc_probs):
+        '''
+        :param states: list of state labels, indexed by state id
+        :param symbols: list of symbols (inputs and outputs), indexed by symbol id
+        :param initial, final: state ids
+        arc_offsets has one entry per state plus one; arc_inputs, arc_next, arc_outputs, arc_probs one entry per arc
+        '''
+        self.states, self.symbols = states, symbols
+        self.state2id = {state: state_id for state_id, state in enumerate(states)}
+        self.symbol2id = {symbol: symbol_id for symbol_id, symbol in enumerate(symbols)}
+        self.initial, self.final = initial, final
+        self.arc_offsets, self.arc_inputs = arc_offsets, arc_inputs
+        self.arc_next, self.arc_outputs, self.arc_probs = arc_next, arc_outputs, arc_probs
+        #the same weights as costs (-log probability) for the log and tropical semirings (see weighted_fst.py)
+        self.arc_costs = array('d', (to_cost(prob) for prob in arc_probs))
+
+    def __str__(self):
+        return 'A compiled FST with {} states, {} arcs and {} symbols'.format(len(self.states), len(self.arc_next),
+                                                                             len(self.symbols))
+
+    @classmethod
+    def compile(cls, initial_state, final_state, transitions):
+        '''
+        :param initial_state, final_state, transitions: as returned by strip_carmel_fst_file
+        '''
+        states, state2id = [], {}
+        symbols, symbol2id = [], {}
+
+        def intern(label, labels, label2id):
+            if label not in label2id:
+                label2id[label] = len(labels)
+                labels.append(label)
+            return label2id[label]
+
+        intern(initial_state, states, state2id)
+        intern(final_state, states, state2id)
+        arcs_by_state = {}
+        for state, input_dict in transitions.items():
+            state_id = intern(state, states, state2id)
+            for input_symbol, neighbours in input_dict.items():
+                input_id = intern(input_symbol, symbols, symbol2id)
+                #sorted is stable, so equal probabilities keep the dict order, like in dijkstra_viterbi
+                for (next_state, output), prob in sorted(neighbours.items(), key=lambda item: item[1], reverse=True):
+                    arcs_by_state.setdefault(state_id, []).append(
+                        (input_id, intern(next_state, states, state2id), intern(output, symbols, symbol2id),
+                         float(prob)))
+        arc_offsets = array('i', [0])
+        arc_inputs, arc_next, arc_outputs, arc_probs = array('i'), array('i'), array('i'), array('d')
+        for state_id in range(len(states)):
+            #stable sort on the input symbol keeps the probability order within a symbol
+            for input_id, next_id, output_id, prob in sorted(arcs_by_state.get(state_id, []), key=lambda arc: arc[0]):
+                arc_inputs.append(input_id)
+                arc_next.append(next_id)
+                arc_outputs.append(output_id)
+                arc_probs.append(prob)
+            arc_offsets.append(len(arc_next))
+        return cls(states, symbols, state2id[initial_state], state2id[final_state], arc_offsets, arc_inputs,
+                   arc_next, arc_outputs, arc_probs)
+
+    @classmethod
+    def from_file(cls, input_file):
+        '''
+        Builds the arc arrays straight from the streamed carmel file (carmel_format.read_carmel), without the
+        transitions dict of strip_carmel_fst_file. The result is the same as compile(*strip_carmel_fst_file(...)).
+        A file ending in .cfst is loaded as a binary compiled FST (see save).
+        '''
+        if input_file.endswith(BINARY_SUFFIX):
+            return cls.load(input_file)
+        arcs = read_carmel(input_file, 2)
+        final_state = next(arcs)
+        states, state2id, symbols, symbol2id = [], {}, [], {}
+
+        def intern(label, labels, label2id):
+            label_id = label2id.get(label)
+            if label_id is None:
+                label_id = label2id[label] = len(labels)
+                labels.append(label)
+            return label_id
+
+        arc_states, arc_inputs, arc_next, arc_outputs, arc_probs = [], [], [], [], []
+        seen = {} #(state, input, next state, output): arc, a repeated arc keeps its place but takes the last weight
+        initial = None
+        for state, next_state, (input_symbol, output), prob in arcs:
+            state_id = intern(state, states, state2id)
+            if initial is None:
+                initial = state_id
+                intern(final_state, states, state2id)
+            key = (state_id, intern(input_symbol, symbols, symbol2id), intern(next_state, states, state2id),
+                   intern(output, symbols, symbol2id))
+            prob = prob if prob is not None else 1
+            if key in seen:
+                arc_probs[seen[key]] = prob
+                continue
+            seen[key] = len(arc_states)
+            for column, value in zip((arc_states, arc_inputs, arc_next, arc_outputs, arc_probs), key + (prob,)):
+                column.append(value)
+        if initial is None:
+            raise ValueError('No arcs in {}'.format(input_file))
+        #by state, then input symbol, then descending probability. sorted is stable so ties keep the file order
+        order = sorted(range(len(arc_states)), key=lambda arc: (arc_states[arc], arc_inputs[arc], -arc_probs[arc]))
+        arc_offsets = array('i', [0])*(len(states)+1)
+        for state_id in arc_states:
+            arc_offsets[state_id+1] += 1
+        for state_id in range(len(states)):
+            arc_offsets[state_id+1] += arc_offsets[state_id]
+        return cls(states, symbols, initial, state2id[final_state], arc_offsets,
+                   array('i', (arc_inputs[arc] for arc in order)), array('i', (arc_next[arc] for arc in order)),
+                   array('i', (arc_outputs[arc] for arc in order)), array('d', (arc_probs[arc] for arc in order)))
+
+    def save(self, filename):
+        '''
+        Writes the compiled arrays to a binary file: a header of counts, the state and symbol names (utf-8, \\0
+        separated), then the raw arrays (in native byte order, so the file is for the same kind of machine).
+        '''
+        names = '\0'.join(self.states + self.symbols).encode('utf-8')
+        with open(filename, 'wb') as outfile:
+            outfile.write(BINARY_MAGIC)
+            outfile.write(struct.pack('<6q', len(self.states), len(self.symbols), len(self.arc_next), self.initial,
+                                      self.final, len(names)))
+            outfile.write(names)
+            for arc_array in (self.arc_offsets, self.arc_inputs, self.arc_next, self.arc_outputs, self.arc_probs):
+                arc_array.tofile(outfile)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as infile:
+            if infile.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise ValueError('{} is not a compiled FST file'.format(filename))
+            num_states, num_symbols, num_arcs, initial, final, names_length = struct.unpack('<6q', infile.read(48))
+            names = infile.read(names_length).decode('utf-8').split('\0')
+            arc_arrays = []
+            for typecode, length in (('i', num_states+1), ('i', num_arcs), ('i', num_arcs), ('i', num_arcs),
+                                     ('d', num_arcs)):
+                arc_array = array(typecode)
+                arc_array.fromfile(infile, length)
+                arc_arrays.append(arc_array)
+        return cls(names[:num_states], names[num_states:num_states+num_symbols], initial, final, *arc_arrays)
+
+    def arcs(self, state_id, input_id):
+        #range of the arcs of state_id on input_id
+        start, end = self.arc_offsets[state_id], self.arc_offsets[state_id+1]
+        return range(bisect_left(self.arc_inputs, input_id, start, end),
+                     bisect_right(self.arc_inputs, input_id, start, end))
+
+    def decode(self, input_symbols):
+        '''
+        :param input_symbols: list of input symbols (*e* symbols are skipped)
+        :return: list of output symbols of the most probable accepting path (or None if there is none), its probability
+        '''
+        input_ids = [self.symbol2id.get(symbol, -1) for symbol in input_symbols if symbol != EPSILON]
+        if -1 in input_ids:
+            return None, 0
+        arc_next, arc_probs = self.arc_next, self.arc_probs
+        #one dict per index of state id: (probability, previous state id, previous index, arc), in the order the
+        #states were first reached
+        table = [{self.initial: (1, -1, -1, -1)}]
+        self.epsilon_closure(table, 0)
+        for index, input_id in enumerate(input_ids):
+            next_states = {}
+            for state_id, (prob, _, _, _) in table[index].items():
+                for arc in self.arcs(state_id, input_id):
+                    next_id, new_prob = arc_next[arc], arc_probs[arc]*prob
+                    if next_id not in next_states or new_prob > next_states[next_id][0]:
+                        next_states[next_id] = (new_prob, state_id, index, arc)
+            if not next_states:
+                return None, 0
+            table.append(next_states)
+            self.epsilon_closure(table, index+1)
+        if self.final not in table[-1]:
+            return None, 0
+        outputs, state_id, index = [], self.final, len(input_ids)
+        prob, prev_state, prev_index, arc = table[index][state_id]
+        while arc >= 0:
+            outputs.append(self.symbols[self.arc_outputs[arc]])
+            prob, prev_state, prev_index, arc = table[prev_index][prev_state]
+        outputs.reverse()
+        return outputs, table[-1][self.final][0]
+
+    def epsilon_closure(self, table, index):
+        #adds the states reachable by *e* arcs to table[index], best first (see fst_acceptor2.epsilon_closure)
+        epsilon_id = self.symbol2id.get(EPSILON)
+        if epsilon_id is None:
+            return
+        states = table[index]
+        heap = [(-entry[0], order, state_id) for order, (state_id, entry) in enumerate(states.items())
+                if self.arcs(state_id, epsilon_id)]
+        heapify(heap)
+        order, done = len(heap), set()
+        while heap:
+            neg_prob, _, state_id = heappop(heap)
+            if state_id in done or -neg_prob < states[state_id][0]:
+                continue
+            done.add(state_id)
+            prob = states[state_id][0]
+            for arc in self.arcs(state_id, epsilon_id):
+                next_id, new_prob = self.arc_next[arc], self.arc_probs[arc]*prob
+                if next_id not in done and (next_id not in states or new_prob > states[next_id][0]):
+                    states[next_id] = (new_prob, state_id, index, arc)
+                    heappush(heap, (-new_prob, order, next_id))
+                    order += 1
+
+
+class BatchDecoder:
+    '''
+    Decodes many lines with one CompiledFST, like CompiledFST.decode, but without building dicts and tuples per line.
+    All the per line state is in scratch lists allocated once (and grown if a line needs more):
+    - one entry per (state, index) reached: entry_state, entry_prev (entry it came from), entry_arc, entry_prob. The
+    entries of index i are step_starts[i]:step_starts[i+1]
+    - slot[state] is the entry of state at the current index, valid only if stamp[state] == generation. generation goes
+    up by one per index, so nothing has to be cleared between indexes or lines.
+    '''
+    def __init__(self, fst, capacity=4096):
+        self.fst = fst
+        self.epsilon_id = fst.symbol2id.get(EPSILON)
+        #plain lists rather than arrays: indexing a list doesn't box a new int or float each time
+        self.slot = [0]*len(fst.states)
+        self.stamp = [-1]*len(fst.states)
+        self.generation = -1
+        self.entry_state, self.entry_prev, self.entry_arc = [0]*capacity, [0]*capacity, [0]*capacity
+        self.entry_prob = [0.0]*capacity
+        self.num_entries = 0
+
+    def add_entry(self, state_id, prev, arc, prob):
+        if self.num_entries == len(self.entry_state):
+            for entries in (self.entry_state, self.entry_prev, self.entry_arc, self.entry_prob):
+                entries.extend(entries) #double the capacity
+        entry = self.num_entries
+        self.entry_state[entry], self.entry_prev[entry], self.entry_arc[entry] = state_id, prev, arc
+        self.entry_prob[entry] = prob
+        self.slot[state_id], self.stamp[state_id] = entry, self.generation
+        self.num_entries += 1
+        return entry
+
+    def relax(self, state_id, prev, arc, prob):
+        #adds or improves the entry of state_id at the current index. :return: the entry if it changed, else -1
+        if self.stamp[state_id] != self.generation:
+            return self.add_entry(state_id, prev, arc, prob)
+        entry = self.slot[state_id]
+        if prob > self.entry_prob[entry]:
+            self.entry_prev[entry], self.entry_arc[entry], self.entry_prob[entry] = prev, arc, prob
+            return entry
+        return -1
+
+    def decode(self, input_symbols):
+        '''
+        :param input_symbols: list of input symbols (*e* symbols are skipped)
+        :return: list of output symbols of the most probable accepting path (or None if there is none), its probability
+        '''
+        fst = self.fst
+        input_ids = [fst.symbol2id.get(symbol, -1) for symbol in input_symbols if symbol != EPSILON]
+        if -1 in input_ids:
+            return None, 0
+        self.num_entries = 0
+        self.generation += 1
+        self.add_entry(fst.initial, -1, -1, 1)
+        step_start = 0
+        self.epsilon_closure(step_start)
+        arc_offsets, arc_inputs, arc_next, arc_probs = fst.arc_offsets, fst.arc_inputs, fst.arc_next, fst.arc_probs
+        slot, stamp = self.slot, self.stamp
+        for input_id in input_ids:
+            step_end = self.num_entries
+            self.generation += 1
+            generation = self.generation
+            #fst.arcs and add_entry are inlined, this is the inner loop
+            num_entries = step_end
+            for entry in range(step_start, step_end):
+                prob, state_id = self.entry_prob[entry], self.entry_state[entry]
+                start, end = arc_offsets[state_id], arc_offsets[state_id+1]
+                for arc in range(bisect_left(arc_inputs, input_id, start, end),
+                                 bisect_right(arc_inputs, input_id, start, end)):
+                    next_id, new_prob = arc_next[arc], arc_probs[arc]*prob
+                    if stamp[next_id] != generation:
+                        if num_entries == len(self.entry_state):
+                            self.num_entries = num_entries
+                            self.add_entry(next_id, entry, arc, new_prob)
+                        else:
+                            self.entry_state[num_entries], self.entry_prev[num_entries] = next_id, entry
+                            self.entry_arc[num_entries], self.entry_prob[num_entries] = arc, new_prob
+                            slot[next_id], stamp[next_id] = num_entries, generation
+                        num_entries += 1
+                    elif new_prob > self.entry_prob[slot[next_id]]:
+                        next_entry = slot[next_id]
+                        self.entry_prev[next_entry], self.entry_arc[next_entry] = entry, arc
+                        self.entry_prob[next_entry] = new_prob
+            self.num_entries = num_entries
+            if num_entries == step_end:
+                return None, 0
+            step_start = step_end
+            self.epsilon_closure(step_start)
+        if self.stamp[fst.final] != self.generation:
+            return None, 0
+        entry = self.slot[fst.final]
+        prob, outputs = self.entry_prob[entry], []
+        while self.entry_arc[entry] >= 0:
+            outputs.append(fst.symbols[fst.arc_outputs[self.entry_arc[entry]]])
+            entry = self.entry_prev[entry]
+        outputs.reverse()
+        return outputs, prob
+
+    def epsilon_closure(self, step_start):
+        #as CompiledFST.epsilon_closure, for the entries from step_start on
+        if self.epsilon_id is None:
+            return
+        fst, epsilon_id = self.fst, self.epsilon_id
+        heap = [(-self.entry_prob[entry], entry - step_start, entry) for entry in range(step_start, self.num_entries)
+                if fst.arcs(self.entry_state[entry], epsilon_id)]
+        heapify(heap)
+        order, done = len(heap), set()
+        while heap:
+            neg_prob, _, entry = heappop(heap)
+            if entry in done or -neg_prob < self.entry_prob[entry]:
+                continue
+            done.add(entry)
+            prob = self.entry_prob[entry]
+            for arc in fst.arcs(self.entry_state[entry], epsilon_id):
+                next_id = fst.arc_next[arc]
+                if self.stamp[next_id] == self.generation and self.slot[next_id] in done:
+                    continue
+                next_entry = self.relax(next_id, entry, arc, fst.arc_probs[arc]*prob)
+                if next_entry >= 0:
+                    heappush(heap, (-self.entry_prob[next_entry], order, next_entry))
+                    order += 1
+
+
+def format_result(line, outputs, prob):
+    #the fst_acceptor2.py output line
+    result = '"'+'" "'.join(outputs)+'"' if outputs is not None else '*none*'
+    return '{} => {} {:g}'.format(line.strip(), result, prob)
+
+
+def read_fst(input_file):
+    #CompiledFST.from_file for the command line scripts: exits with the fst_acceptor2.py message on a malformed file
+    try:
+        return CompiledFST.from_file(input_file)
+    except ValueError as error:
+        sys.exit(str(error) if input_file.endswith(BINARY_SUFFIX) else INVALID_FST)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == '--save':
+        #compiled_fst.py --save fst_file compiled_file.cfst
+        read_fst(sys.argv[2]).save(sys.argv[3])
+        sys.exit()
+    fst = read_fst(sys.argv[1])
+    with open(sys.argv[2], 'r') as file:
+        for line in skip_pycomments(file):
+            outputs, prob = fst.decode(re.sub('"', '', line).strip().split())
+            print(format_result(line, outputs, prob))
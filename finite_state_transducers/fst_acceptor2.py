@@ -1,19 +1,25 @@
 
 import operator
-from collections import defaultdict, deque
+from collections import defaultdict
+from heapq import heapify, heappush, heappop
 
 import sys
+import argparse
+from multiprocessing import Pool
 
 import re
 
+from carmel_format import read_carmel
+
 '''
 See readme for more information.
 #
 '''
 
 class Graph:
-    def __init__(self, start=None, finish=None, transitions=defaultdict(dict)):
-        self.transitions = transitions
+    def __init__(self, start=None, finish=None, transitions=None):
+        #a default of defaultdict(dict) would be one dict shared by every Graph made without transitions
+        self.transitions = transitions if transitions is not None else defaultdict(dict)
         self.start = Node(start,('**','**',1)) ## initialise predecessor of start to symbols so know when find it (and can distinguish from other Nones)
         self.finish = Node(finish,probability=0)
         self.nodes = {start:self.start, finish:self.finish} #dict of label: Node object
@@ -50,98 +56,93 @@ class Node:
     def get_predecessor(self):
         return  self.predecessor
 
-#    REPLACE ALL PREDECESSOR AND PROBABILITY SHIT WITH THE STATE TABLE
 
-def dijkstra_viterbi(input,graph): #input is assumed to be a string, graph is a Graph Object
+EPSILON = '*e*'
+INVALID_FST = 'Invalid FST input. Input file in format:\n A\n(A (A "a" "b")\n(A (A "b" "c"))\netc.\nEmpty strings in both FST and input are denoted with *e*'
 
-    #Initialise backtrace table (state_table) with a nested dictionary to keep track
-    #of each state at each timestep, which is to say, at each index.
-    state_table = defaultdict(defaultdict)
-    #initialise queue
-    search_states = deque()
+def dijkstra_viterbi(input,graph): #input is assumed to be a list of symbols, graph is a Graph Object
+    '''
+    Viterbi by timesteps, like viterbi_hmm/viterbi.py. The old version queued (node, index) again every time an arc reached
+    it, so the same state at the same index was expanded over and over and the queue grew exponentially with the input
+    length on dense FSTs.
+    Now state_table[index] holds every state reachable after reading input[:index], with its best predecessor. The states
+    at index are each expanded once on input[index] into index+1, then the epsilon closure of index+1 is added (*e* arcs
+    don't consume input so they stay at the same index). *e* symbols in the input are empty and are skipped.
+    :return: list of outputs of the best path, last output first (or '*none*'), probability of the path
+    '''
+    input = [symbol for symbol in input if symbol != EPSILON]
+    transitions = graph.get_transitions()
+    start, finish = graph.get_start().label, graph.get_finish().label
     end_of_input = len(input)  # an imaginary "end of input" index, basically a STOP index
-    #add start
-    start = graph.get_start()
-    finish = graph.get_finish()
-    next_index = 0 #start to look at input string
-    start_predecessor = ('**', '**', 1)
-    winner = None
-    final_output = []  # to store eventual output
+    state_table = [{} for _ in range(end_of_input+1)] #{state: predecessor info} per index
 
     #initialise
-    update_state_table(state_table, start_predecessor, start, next_index)
-    search_states.append((start, next_index))
-    #current_node = None
-    while search_states:
-        current_node, next_index = search_states.popleft() #this will first be the start, then FIFO ordered by priority. FIFO is maybe not the best way to do this but it's a first go since it's simpler
-        #update_state_table(state_table, predecessor, current_node, next_index) #maybe this should be index-1?
-        if accept_state(current_node, next_index, finish, end_of_input): #input is done and node is a finish node
-            winner = current_node
-            #update_state_table(state_table, predecessor, winner, next_index)
-            break
-        #if we are not in a finish state
-        #if transitions from node on input then update current node with neighborus, and push the neighbours onto the queue in order of priority
-        try:
-            neighbours = graph.transitions[current_node.label][input[next_index]] #a dict of (node,output):prob (tuple:float)
-            # initialise new nodes based on transition dict data, and the possible neighbours for a given input
-            for entry in sorted(neighbours.items(), key=operator.itemgetter(1), reverse=True): #1 is the index of the transition probability, sort in descending order
-                label, output, prob = entry[0][0], entry[0][1], entry[1]
-                prev_state_prob = state_table[current_node][next_index][2]
-                new_prob = prob*prev_state_prob #the probability after taking this transition, so of having reached this next node on this input
-                next_node_predecessor = (current_node, output, new_prob)
-                try:
-                    existing_node = graph.get_nodes(label)
-                    next_node = existing_node
-                except KeyError: #if node doesn't exist, create it and add it to the graph's nodes
-                    next_node = Node(label, next_node_predecessor, new_prob)
-                    graph.nodes[label] = next_node
-                update_state_table(state_table, next_node_predecessor, next_node, next_index+1)
-                search_states.append((next_node, next_index+1)) #append the node found and the next index to look at
-
-        except KeyError:
-            continue #if there is nothing to be done on the available input, continue the loop to try the rest of the queue
-        except IndexError:  #need something here so that if reached end of input and didn't accept, doesn't end up with index out of range errors
-            #break
-            continue
-
-    if winner:
-        winner_prob = state_table[winner][end_of_input][2]
-        return backtrace(winner, end_of_input, final_output, state_table), winner_prob #return result of recursive backtrace and probability, round to 3 sig figs
-        #also will have to return probability
-
+    update_state_table(state_table, ('**', '**', '**', 1), start, 0)
+    epsilon_closure(state_table, transitions, 0)
+    for index in range(end_of_input):
+        #dicts keep insertion order, so states are expanded in the order they were first reached
+        for state, predecessor in state_table[index].items():
+            neighbours = transitions.get(state, {}).get(input[index]) #a dict of (state,output):prob (tuple:float)
+            if not neighbours:
+                continue
+            for (next_state, output), prob in sorted(neighbours.items(), key=operator.itemgetter(1), reverse=True):
+                #the probability after taking this transition, so of having reached this next state on this input
+                update_state_table(state_table, (state, index, output, prob*predecessor[3]), next_state, index+1)
+        if not state_table[index+1]:
+            return '*none*', 0 #nothing can read the rest of the input
+        epsilon_closure(state_table, transitions, index+1)
+
+    if finish in state_table[end_of_input]:
+        return backtrace(finish, end_of_input, state_table), state_table[end_of_input][finish][3]
     else:
         return '*none*', 0 #return none and zero probability
 
-def backtrace(node, index, final_output, state_table): #traces back through the paths from state_table generated by dijkstra_viterbi and returns the output
-    predecessor = state_table[node][index]
-    if predecessor[0] != '**': #symbol for predecessor of start
-        prev_node, output_char = predecessor[0], predecessor[1]
-        final_output.append(output_char)
-        backtrace(prev_node,index-1,final_output,state_table)
+def epsilon_closure(state_table, transitions, index):
+    '''
+    Adds the states reachable from state_table[index] by *e* arcs. States are finalised best first (Dijkstra), so with
+    probabilities <= 1 each is expanded once and epsilon cycles terminate.
+    '''
+    states = state_table[index]
+    heap = [(-predecessor[3], order, state) for order, (state, predecessor) in enumerate(states.items())
+            if EPSILON in transitions.get(state, {})]
+    if not heap:
+        return
+    heapify(heap)
+    order = len(heap)
+    done = set()
+    while heap:
+        neg_prob, _, state = heappop(heap)
+        if state in done or -neg_prob < states[state][3]:
+            continue #already finalised, or a stale entry
+        done.add(state)
+        neighbours = transitions.get(state, {}).get(EPSILON, {})
+        for (next_state, output), prob in sorted(neighbours.items(), key=operator.itemgetter(1), reverse=True):
+            if next_state not in done and update_state_table(state_table, (state, index, output, prob*states[state][3]),
+                                                             next_state, index):
+                heappush(heap, (-states[next_state][3], order, next_state))
+                order += 1
+
+def backtrace(state, index, state_table): #traces back through the paths from state_table generated by dijkstra_viterbi and returns the output
+    final_output = []
+    predecessor = state_table[index][state]
+    while predecessor[0] != '**': #symbol for predecessor of start
+        final_output.append(predecessor[2])
+        state, index = predecessor[0], predecessor[1]
+        predecessor = state_table[index][state]
     return final_output
 
-def accept_state(current_node, next_index, finish, end_of_input):
-    if current_node == finish and next_index == end_of_input:
-        return True
-    else:
-        return False
-
-def update_state_table(state_table, predecessor, current_node, next_index): #can I leave state table out of passing it around? Since it's implicitly global
+def update_state_table(state_table, predecessor, state, index):
     '''
-    when pop a node off the queue add the predecessor information (state it came from, output that got it there, probability)
-    to the state table at the point we're looking up (NOT at the predecessor)
-    State table is in format {state: {index : predecessor info}}. Should mean that whenever encounter the same
-    state at same index, the more probable path to that point will win.
+    State table is in format [{state: predecessor info}], one dict per index, and predecessor info is (previous state,
+    previous index, output from the transition, probability from start). Whenever we reach the same state at the same
+    index, the more probable path to that point wins.
+    :return: True if the entry was added or replaced
     '''
-    #Check if there is an entry at current_node next index in state_table
-    try:
-        current_value = state_table[current_node][next_index]
-
-        if predecessor[2] > current_value[2]: #comparing the probabilities in the tuples
-            state_table[current_node][next_index] = predecessor
-
-    except KeyError:
-        state_table[current_node][next_index] = predecessor
+    current_value = state_table[index].get(state)
+    if current_value is None or predecessor[3] > current_value[3]: #comparing the probabilities in the tuples
+        state_table[index][state] = predecessor
+        return True
+    return False
 
 
 
@@ -150,41 +151,25 @@ example input line from file (S3 (S4 "can"  "NOUN" 0.4))
 '''
 
 def strip_carmel_fst_file(input_file):
-    with open(input_file, 'rU') as file:
-        line_list = [line.strip() for line in skip_pycomments(file)]
-
-    final_state = line_list[0]
-    initial_state = strip_line(line_list[1])[0] #grabs first element of the list returned as carmel files
-                                                # specify start state as first state in second line of file
+    #the file is streamed and tokenized by carmel_format.read_carmel, which keeps quoted symbols whole
+    arcs = read_carmel(input_file, 2)
+    initial_state = None
     #time to build the transitions
     transitions = defaultdict(dict)
-    for line in line_list[1:]:
-        if line:
-            new_trans = strip_line(line)
-            if len(new_trans) == 5: #allows it to accept FSTs with no probabilities, (A (A "a" "b")) by defaulting to 1
-                state, input, next_state, output, prob = new_trans[0], new_trans[2], new_trans[1], new_trans[3], float(new_trans[4])
-            elif len(new_trans) == 4:
-                state, input, next_state, output, prob = new_trans[0], new_trans[2], new_trans[1], new_trans[3], 1
-            else:
-                sys.exit('Invalid FST input. Input file in format:\n A\n(A (A "a" "b")\n(A (A "b" "c"))\netc.\nEmpty strings in both FST and input are denoted with *e*')
-            if not transitions[state]: #if state not in dict then assign a new dict to it
-                #Example structure {'1': {'can': {(3, 'AUX'): 0.8}}} -- 3 layers
-                transitions[state] = {input:{(next_state,output):prob}} #make sure these dictionary assignments work
-            else:
-                try:
-                    if transitions[state][input]: #check next layer of nesting
-                        transitions[state][input][(next_state, output)] = prob
-                except KeyError:
-                    transitions[state][input] = {(next_state,output):prob}
+    try:
+        final_state = next(arcs)
+        for state, next_state, (input, output), prob in arcs:
+            if initial_state is None:
+                initial_state = state #carmel files specify the start state as the first state of the first arc
+            #Example structure {'1': {'can': {(3, 'AUX'): 0.8}}} -- 3 layers
+            #allows it to accept FSTs with no probabilities, (A (A "a" "b")) by defaulting to 1
+            transitions[state].setdefault(input, {})[(next_state, output)] = prob if prob is not None else 1
+    except ValueError:
+        sys.exit(INVALID_FST)
 
     return [initial_state,final_state,transitions]
 
 
-def strip_line(line):
-    replace_parens = re.sub('(\)|\()',' ',line)
-    strip_quotes = re.sub('"','',replace_parens).split()
-    return strip_quotes
-
 def skip_pycomments(input):
     for line in input:
         line = line.strip()
@@ -192,22 +177,42 @@ def skip_pycomments(input):
             if not line.lstrip().startswith('#'):
                 yield line
 
+#each pool worker gets the compiled FST once, in the initializer
+worker_data = {}
+
+def init_worker(fst):
+    from compiled_fst import BatchDecoder
+    worker_data['decoder'] = BatchDecoder(fst)
+
+def decode_line(line):
+    from compiled_fst import format_result
+    outputs, prob = worker_data['decoder'].decode(re.sub('"', '', line).strip().split())
+    return format_result(line, outputs, prob)
+
+def decode_lines(fst, lines, procs=1, chunksize=64):
+    '''
+    Decodes lines with one compiled FST (compiled_fst.CompiledFST), in a pool of procs processes if procs > 1.
+    :return: generator of output lines, in input order, as soon as each is ready
+    '''
+    if procs > 1:
+        with Pool(procs, init_worker, (fst,)) as pool:
+            yield from pool.imap(decode_line, lines, chunksize)
+    else:
+        init_worker(fst)
+        for line in lines:
+            yield decode_line(line)
+
 if __name__ == "__main__":
-    input_fst = sys.argv[1]
-    input_file = sys.argv[2]
-    graph_data = strip_carmel_fst_file(input_fst)
-    #print(new_graph)
-    with open(input_file, 'rU') as file:
-        line_list = [line.strip() for line in skip_pycomments(file)]
-        for line in line_list:
-            line_as_string = re.sub('"', '', line).strip().split()
-            result, prob = dijkstra_viterbi(line_as_string, Graph(*graph_data))
-
-            if isinstance(result,list): #reverse before returning, unless failed and result was string *none*
-                result.reverse()
-                result = '"'+'" "'.join(result)+'"' #make it look like it is carmel
-
-            print('{} => {} {:g}'.format(line.strip(), result, prob))
-            #break #this is there temporarily to do only one line
+    from compiled_fst import read_fst
+    parser = argparse.ArgumentParser(description='Finds the most probable path (and output) of an FST for each input line')
+    parser.add_argument('input_fst')
+    parser.add_argument('input_file')
+    parser.add_argument('--procs', type=int, default=1, help='decode the lines in a pool of this many processes')
+    args = parser.parse_args()
+    #the FST is compiled once for the whole file, rather than making a Graph per line
+    fst = read_fst(args.input_fst)
+    with open(args.input_file, 'r') as file:
+        for output_line in decode_lines(fst, skip_pycomments(file), args.procs):
+            print(output_line)
 
 ###NEED TO ADD DEFAULT VALUES to make sure that if no probabilities are given, assume P = 1
@@ -0,0 +1,169 @@
+'''
+FST weights in the log and tropical semirings, composition of an input string with an FST, and shortest path.
+
+dijkstra_viterbi multiplies probabilities, which underflows to 0 on long inputs. Here a weight is a cost, -log(p), so
+paths are scored by adding costs:
+- tropical semiring: plus is min, times is +. The best path weight (Viterbi).
+- log semiring: plus is -log(e^-a + e^-b), times is +. The total weight of all paths, i.e. -log P(input).
+
+The input string is a linear automaton (states 0..n, input[i] on the arc i -> i+1). Its composition with the FST has
+states (index, FST state), and an arc for every FST arc on input[index] (to index+1) or on *e* (staying at index).
+shortest_path runs Dijkstra over the composition, building it lazily as states are popped, and stops as soon as
+(n, final) is popped, so the rest of the composition is never built. Costs have to be >= 0 (probabilities <= 1).
+
+Command to run: weighted_fst.py fst_file input_file [--costs] [--total]
+Prints fst_acceptor2.py lines (best path and probability). --costs prints the cost of the path instead of the
+probability (it doesn't underflow), --total also prints the log semiring weight of all accepting paths (inf, or cost
+-inf, if an epsilon cycle of probability >= 1 makes it unbounded).
+'''
+
+import re
+import math
+import argparse
+from heapq import heappush, heappop
+
+from fst_acceptor2 import EPSILON, skip_pycomments
+from compiled_fst import format_result, read_fst
+
+
+def log_plus(a, b):
+    #-log(e^-a + e^-b), without leaving log space
+    if a == math.inf:
+        return b
+    if b == math.inf:
+        return a
+    return min(a, b) - math.log1p(math.exp(-abs(a-b)))
+
+
+class Semiring:
+    def __init__(self, name, plus, zero=math.inf, one=0.0):
+        self.name = name
+        self.plus = plus
+        self.zero, self.one = zero, one
+
+    def __str__(self):
+        return 'The {} semiring'.format(self.name)
+
+    @staticmethod
+    def times(a, b):
+        return a + b
+
+
+TROPICAL = Semiring('tropical', min)
+LOG = Semiring('log', log_plus)
+
+
+def composed_arcs(fst, input_ids, index, state_id):
+    '''
+    The arcs of state (index, state_id) in the composition of the linear automaton of input_ids with fst.
+    :return: generator of ((next index, next state id), fst arc)
+    '''
+    epsilon_id = fst.symbol2id.get(EPSILON)
+    if epsilon_id is not None:
+        for arc in fst.arcs(state_id, epsilon_id):
+            yield (index, fst.arc_next[arc]), arc
+    if index < len(input_ids):
+        for arc in fst.arcs(state_id, input_ids[index]):
+            yield (index+1, fst.arc_next[arc]), arc
+
+
+def input_ids(fst, input_symbols):
+    #symbol ids of the input (*e* skipped), or None if a symbol isn't in the FST
+    ids = [fst.symbol2id.get(symbol, -1) for symbol in input_symbols if symbol != EPSILON]
+    return None if -1 in ids else ids
+
+
+def shortest_path(fst, input_symbols):
+    '''
+    Dijkstra (tropical semiring) over the lazily built composition of the input with fst.
+    :return: list of output symbols of the best path (or None), cost of the path (inf if there is none)
+    '''
+    ids = input_ids(fst, input_symbols)
+    if ids is None:
+        return None, math.inf
+    start, goal = (0, fst.initial), (len(ids), fst.final)
+    best = {start: 0.0}
+    backpointers = {start: None} #composed state: (previous composed state, fst arc)
+    done = set()
+    heap = [(0.0, 0, start)]
+    order = 1
+    while heap:
+        cost, _, state = heappop(heap)
+        if state in done:
+            continue
+        if state == goal: #early stop, nothing left in the queue can do better
+            outputs = []
+            while backpointers[state] is not None:
+                state, arc = backpointers[state]
+                outputs.append(fst.symbols[fst.arc_outputs[arc]])
+            outputs.reverse()
+            return outputs, cost
+        done.add(state)
+        for next_state, arc in composed_arcs(fst, ids, *state):
+            new_cost = cost + fst.arc_costs[arc]
+            if next_state not in done and new_cost < best.get(next_state, math.inf):
+                best[next_state] = new_cost
+                backpointers[next_state] = (state, arc)
+                heappush(heap, (new_cost, order, next_state))
+                order += 1
+    return None, math.inf
+
+
+def shortest_distance(fst, input_symbols, semiring=LOG, delta=1e-9, max_expansions=100000):
+    '''
+    The semiring sum of the weights of all accepting paths of the input, with the generic single source shortest
+    distance algorithm (Mohri 2002) over the composition. In the log semiring this is -log P(input) summed over every
+    path; in the tropical semiring it is the cost of the best path. A state is only requeued if its distance changes
+    by more than delta, so epsilon cycles of probability < 1 converge. One of probability >= 1 (e.g. in an unweighted
+    FST, where every arc is 1) never does: its weight grows on every lap. A state expanded more than max_expansions
+    times is taken to be on such a cycle, and the result is -inf (infinite weight).
+    '''
+    ids = input_ids(fst, input_symbols)
+    if ids is None:
+        return semiring.zero
+    start, goal = (0, fst.initial), (len(ids), fst.final)
+    distance = {start: semiring.one}
+    residual = {start: semiring.one} #weight added to the state since it was last expanded
+    expansions = {}
+    #composed states are (index, state id), so the heap pops the lowest index first and states are mostly expanded
+    #after everything that reaches them
+    heap, queued = [start], {start}
+    while heap:
+        state = heappop(heap)
+        queued.discard(state)
+        expansions[state] = expansions.get(state, 0) + 1
+        if expansions[state] > max_expansions:
+            return -math.inf
+        weight, residual[state] = residual[state], semiring.zero
+        for next_state, arc in composed_arcs(fst, ids, *state):
+            arc_weight = semiring.times(weight, fst.arc_costs[arc])
+            old = distance.get(next_state, semiring.zero)
+            new = semiring.plus(old, arc_weight)
+            if old == math.inf and new == math.inf or abs(new - old) <= delta:
+                continue
+            distance[next_state] = new
+            residual[next_state] = semiring.plus(residual.get(next_state, semiring.zero), arc_weight)
+            if next_state not in queued:
+                heappush(heap, next_state)
+                queued.add(next_state)
+    return distance.get(goal, semiring.zero)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Shortest path through the composition of each input with an FST')
+    parser.add_argument('fst_file')
+    parser.add_argument('input_file')
+    parser.add_argument('--costs', action='store_true', help='print -log probabilities instead of probabilities')
+    parser.add_argument('--total', action='store_true', help='also print the log semiring weight of all paths')
+    args = parser.parse_args()
+
+    fst = read_fst(args.fst_file)
+    with open(args.input_file, 'r') as file:
+        for line in skip_pycomments(file):
+            symbols = re.sub('"', '', line).strip().split()
+            outputs, cost = shortest_path(fst, symbols)
+            weight = cost if args.costs else math.exp(-cost)
+            result = format_result(line, outputs, weight)
+            if args.total:
+                total = shortest_distance(fst, symbols, LOG)
+                result += ' {:g}'.format(total if args.costs else math.exp(-total))
+            print(result)
@@ -0,0 +1,3 @@
+#!/bin/sh
+
+python3 weighted_fst.py $@
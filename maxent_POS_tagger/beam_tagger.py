@@ -0,0 +1,138 @@
+'''
+A beam search POS tagger on top of the in-process MaxEnt model from maxent_model.py.
+
+The test vectors from maxent_tagger.py use the GOLD prevT and prevTwoTags features, which is fine for measuring the
+classifier but is not real tagging. Here, like Ratnaparkhi (1996), the sentence is tagged left to right and the tag
+features come from the hypotheses in the beam instead.
+
+Command to run: beam_tagger.py model_file train_voc test_file rare_thres beam_size output_file
+
+model_file: me_model.npz written by maxent_model.py
+train_voc: the train_voc file written by maxent_tagger.py (used to decide which words are rare)
+test_file: word/tag sentences, one per line. The tags are only used to compute accuracy
+beam_size: number of hypotheses kept at each position. Smaller is faster, 1 is greedy decoding
+output_file: the tagged sentences in word/tag format
+
+Efficiency: every feature except prevT and prevTwoTags depends only on the words, so the scores of those features are
+computed once per position for the whole sentence (one batched sparse matrix product). At each position the tag features
+of all the hypotheses in the beam are then added in one go, giving a (beam x labels) score matrix.
+'''
+
+import sys
+import re
+from collections import Counter
+
+import numpy as np
+
+from maxent_tagger import process_sentence, context_word_features, tag_features, current_word_features
+from maxent_model import MaxEntModel, build_csr, csr_dot, log_softmax
+
+
+def mallet_safe(feature):
+    #the model was trained on mallet vectors, where commas were replaced with "comma" since , is a delimiter
+    return feature.replace(',', 'comma')
+
+
+def read_voc(input_file):
+    '''
+    :param input_file: train_voc file of format word freq, one per line
+    :return: Counter of word: freq (so unseen words have freq 0)
+    '''
+    voc_dict = Counter()
+    with open(input_file, 'r') as infile:
+        for line in infile:
+            tokens = line.split()
+            if len(tokens) == 2:
+                voc_dict[tokens[0]] = int(tokens[1])
+    return voc_dict
+
+
+class BeamDecoder:
+    def __init__(self, model, voc_dict, rare_thres, beam_size):
+        self.model = model
+        self.voc_dict = voc_dict
+        self.rare_thres = rare_thres
+        self.beam_size = beam_size
+        #an extra row of zeros so that unseen tag features can be looked up like any other (at index num features)
+        self.missing = len(model.features)
+        self.weights = np.vstack([model.weights, np.zeros((1, len(model.labels)))])
+        self.tag_feature_cache = {} #(prev2 tag, prev tag): (prevT index, prevTwoTags index)
+
+    def word_scores(self, sentence):
+        '''
+        Computes the scores of all non tag features at every position of a sentence at once.
+        :param sentence: list of (word, tag) tuples with BOS and EOS padding
+        :return: 2D numpy array (words x labels), including the bias
+        '''
+        voc_dict, rare_thres = self.voc_dict, self.rare_thres
+        feature_lists = []
+        for word_tag_i in range(2, len(sentence)-2):
+            features = list(context_word_features(sentence, word_tag_i))
+            features.extend(current_word_features(sentence[word_tag_i][0], voc_dict, rare_thres))
+            feature_lists.append([mallet_safe(feature) for feature in features])
+        indptr, indices, data = build_csr(feature_lists, self.model.feat2index)
+        return csr_dot(indptr, indices, data, self.model.weights) + self.model.bias
+
+    def tag_feature_indices(self, prev2_tag, prev_tag):
+        key = (prev2_tag, prev_tag)
+        if key not in self.tag_feature_cache:
+            prevT, prevTwoTags = tag_features(prev2_tag, prev_tag)
+            feat2index = self.model.feat2index
+            self.tag_feature_cache[key] = (feat2index.get(mallet_safe(prevT), self.missing),
+                                           feat2index.get(mallet_safe(prevTwoTags), self.missing))
+        return self.tag_feature_cache[key]
+
+    def tag(self, sentence):
+        '''
+        :param sentence: list of (word, tag) tuples with BOS and EOS padding. Tags are ignored
+        :return: list of best tags (model labels), one per word
+        '''
+        labels, num_labels = self.model.labels, len(self.model.labels)
+        word_scores = self.word_scores(sentence)
+        beam = [('BOS', 'BOS')] #each hypothesis is just its last two tags, the rest is in the backpointers
+        beam_scores = np.zeros(1)
+        backpointers = []
+        for position in range(word_scores.shape[0]):
+            tag_indices = np.array([self.tag_feature_indices(*hyp) for hyp in beam])
+            #one (beam x labels) matrix for all hypotheses at this position
+            scores = word_scores[position] + self.weights[tag_indices].sum(axis=1)
+            candidates = (beam_scores[:, None] + log_softmax(scores)).ravel()
+            size = min(self.beam_size, candidates.size)
+            best = np.argpartition(-candidates, size-1)[:size]
+            best = best[np.argsort(-candidates[best], kind='stable')]
+            parents, label_indices = np.divmod(best, num_labels)
+            beam = [(beam[parent][1], labels[label]) for parent, label in zip(parents, label_indices)]
+            beam_scores = candidates[best]
+            backpointers.append((parents, label_indices))
+        #backtrace from the best final hypothesis
+        best_tags, hyp = [], 0
+        for parents, label_indices in reversed(backpointers):
+            best_tags.append(labels[label_indices[hyp]])
+            hyp = parents[hyp]
+        best_tags.reverse()
+        return best_tags
+
+
+if __name__ == "__main__":
+    model_file, voc_file, test_file = sys.argv[1], sys.argv[2], sys.argv[3]
+    rare_thres, beam_size = int(sys.argv[4]), int(sys.argv[5])
+    output_file = sys.argv[6]
+
+    decoder = BeamDecoder(MaxEntModel.load(model_file), read_voc(voc_file), rare_thres, beam_size)
+    regex_obj = re.compile(r'(?<!\\)/')
+    total, total_corr = 0, 0
+    with open(test_file, 'r') as infile, open(output_file, 'w') as outfile:
+        for line in infile:
+            if not line.strip():
+                continue
+            sentence = process_sentence(line, regex_obj)
+            best_tags = decoder.tag(sentence)
+            words_tags = sentence[2:-2]
+            for (word, gold), tag in zip(words_tags, best_tags):
+                total += 1
+                if tag == mallet_safe(gold):
+                    total_corr += 1
+            #model labels are mallet safe, so put the commas back for the output
+            outfile.write(' '.join('{}/{}'.format(word, ',' if tag == 'comma' else tag)
+                                   for (word, gold), tag in zip(words_tags, best_tags)) + '\n')
+    print('Tagging accuracy: {}% ({}/{})'.format(100*total_corr/total if total else 0, total_corr, total))
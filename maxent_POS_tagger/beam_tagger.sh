@@ -0,0 +1,3 @@
+#!/bin/sh
+
+python3 beam_tagger.py $@
\ No newline at end of file
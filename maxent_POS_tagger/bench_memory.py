@@ -0,0 +1,65 @@
+'''
+A benchmark of the peak memory of the per token feature storage in maxent_tagger.py: the old defaultdict(set) keyed by
+(sent_num, word_num, word, tag) against the FeatureStore (flat int32 feature id arrays with per token offsets).
+
+Command to run: bench_memory.py train_file copies rare_thres
+
+copies: the train file is repeated this many times to get a WSJ sized input (examples/wsj_sec0.word_pos is ~1900
+sentences, so 25 copies is about the size of the whole WSJ treebank)
+'''
+
+import sys
+import re
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+from maxent_tagger import process_sentence, make_voc, generate_feature_vectors, context_word_features, \
+    tag_features, current_word_features
+
+
+def generate_feature_sets(input_sentences, voc_dict, rare_thres):
+    #the old storage, for comparison
+    word_label_features = defaultdict(set)
+    feature_vecs = Counter()
+    for sentence_index in range(len(input_sentences)):
+        sentence = input_sentences[sentence_index]
+        for word_tag_i in range(2, len(sentence)-2):
+            prevW, prev2W, nextW, next2W = context_word_features(sentence, word_tag_i)
+            prevT, prevTwoTags = tag_features(sentence[word_tag_i-2][1], sentence[word_tag_i-1][1])
+            features = [prevW, prevT, prev2W, prevTwoTags, nextW, next2W]
+            curW, curT = sentence[word_tag_i]
+            features.extend(current_word_features(curW, voc_dict, rare_thres))
+            for feature in features:
+                feature_vecs[feature] += 1
+                key = (sentence_index+1, word_tag_i-2, curW, curT)
+                word_label_features[key].add(feature)
+    return feature_vecs, word_label_features
+
+
+def measure(function, *args):
+    '''
+    :return: seconds taken and peak memory (MB) allocated while running function
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return seconds, peak/2**20
+
+
+if __name__ == "__main__":
+    train_filename, copies, rare_thres = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+    regex_obj = re.compile(r'(?<!\\)/')
+    with open(train_filename, 'r') as infile:
+        sentences = [process_sentence(line, regex_obj) for line in infile] * copies
+    vocabulary = make_voc([item[0] for sentence in sentences for item in sentence])
+    num_tokens = sum(len(sentence)-4 for sentence in sentences)
+    print('{} sentences, {} tokens'.format(len(sentences), num_tokens))
+
+    for name, function in [('defaultdict(set)', generate_feature_sets), ('FeatureStore', generate_feature_vectors)]:
+        seconds, peak = measure(function, sentences, vocabulary, rare_thres)
+        print('{}: peak {:.1f} MB, {:.1f} s'.format(name, peak, seconds))
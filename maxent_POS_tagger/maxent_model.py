@@ -0,0 +1,261 @@
+'''
+A native MaxEnt (multinomial logistic regression) trainer and classifier, so that the train/test cycle from
+maxent_tagger.py can run without shelling out to mallet (and without a JVM start-up and a text round-trip per step).
+
+Command to run: maxent_model.py train_vectors test_vectors output_dir
+
+train_vectors and test_vectors are in the mallet text format written by maxent_tagger.py:
+instanceName label f1 v1 f2 v2 ...
+
+writes to output_dir:
+me_model.npz - the trained weights, feature names and labels
+sys_out - the classification of test_vectors in mallet classify-file format: instanceName label1 prob1 label2 prob2...
+and prints train and test accuracy to stdout (like mallet's --report train:accuracy --report test:accuracy)
+
+The model is L2 regularised (a gaussian prior, same as mallet's MaxEnt trainer, default variance 1) and is trained with
+L-BFGS. Features are stored as a CSR matrix (indptr, indices, data arrays) so a whole batch is scored with one pass over
+the non-zero features instead of a python loop per instance.
+'''
+
+import sys
+import os
+from collections import deque
+
+import numpy as np
+
+
+def read_vector_file(input_file):
+    '''
+    Reads a mallet text vector file.
+    :param input_file: file of format instanceName label f1 v1 f2 v2, one instance per line
+    :return: list of instance names, list of labels, list of feature lists, list of value lists
+    '''
+    names, labels, feature_lists, value_lists = [], [], [], []
+    with open(input_file, 'r') as infile:
+        for line in infile:
+            tokens = line.split()
+            if len(tokens) < 2:
+                continue
+            names.append(tokens[0])
+            labels.append(tokens[1])
+            #zip drops a dangling feature with no value (an instance where all features were pruned)
+            pairs = list(zip(tokens[2::2], tokens[3::2]))
+            feature_lists.append([feat for feat, val in pairs])
+            value_lists.append([float(val) for feat, val in pairs])
+    return names, labels, feature_lists, value_lists
+
+
+def build_csr(feature_lists, feat2index, value_lists=None):
+    '''
+    Builds a CSR matrix from feature lists. Features not in feat2index are dropped (unseen test features).
+    :param feature_lists: list of lists of feature names, one list per instance
+    :param feat2index: dict of feature name: column index
+    :param value_lists: optional list of lists of feature values. If None all values are 1 (binary features)
+    :return: indptr, indices, data numpy arrays
+    '''
+    indptr = np.zeros(len(feature_lists)+1, dtype=np.int64)
+    indices, data = [], []
+    for row, features in enumerate(feature_lists):
+        values = value_lists[row] if value_lists is not None else [1.0]*len(features)
+        for feat, val in zip(features, values):
+            index = feat2index.get(feat, -1)
+            if index >= 0:
+                indices.append(index)
+                data.append(val)
+        indptr[row+1] = len(indices)
+    return indptr, np.array(indices, dtype=np.int32), np.array(data, dtype=np.float64)
+
+
+def csr_transpose(indptr, indices, data, num_cols):
+    '''
+    Transposes a CSR matrix (i.e. makes the CSC version) so that X^T can be multiplied with csr_dot as well.
+    :return: indptr, indices, data of the transpose
+    '''
+    rows = np.repeat(np.arange(len(indptr)-1, dtype=np.int32), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    t_indptr = np.zeros(num_cols+1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=num_cols), out=t_indptr[1:])
+    return t_indptr, rows[order], data[order]
+
+
+def csr_dot(indptr, indices, data, dense, chunk_rows=50000):
+    '''
+    Multiplies a CSR matrix by a dense matrix. Done in chunks of rows so the gathered (nnz x columns) intermediate
+    stays bounded.
+    :param dense: 2D numpy array with as many rows as the CSR matrix has columns
+    :return: 2D numpy array of (num rows x dense columns)
+    '''
+    num_rows = len(indptr)-1
+    out = np.zeros((num_rows, dense.shape[1]))
+    for row_start in range(0, num_rows, chunk_rows):
+        row_end = min(row_start+chunk_rows, num_rows)
+        start, end = indptr[row_start], indptr[row_end]
+        if start == end:
+            continue
+        gathered = dense[indices[start:end]] * data[start:end, None]
+        row_starts = indptr[row_start:row_end] - start
+        #reduceat misbehaves on empty rows, so only sum the non-empty ones. Empty rows stay zero
+        non_empty = np.diff(indptr[row_start:row_end+1]) > 0
+        out[row_start:row_end][non_empty] = np.add.reduceat(gathered, row_starts[non_empty], axis=0)
+    return out
+
+
+def log_softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    return scores - np.log(np.exp(scores).sum(axis=1, keepdims=True))
+
+
+def lbfgs(objective, x0, max_iter=200, history=10, tol=1e-6):
+    '''
+    Minimises objective with limited memory BFGS (two loop recursion and a backtracking line search).
+    :param objective: function of x returning (value, gradient)
+    :param x0: initial parameters, 1D numpy array
+    :return: the parameters found
+    '''
+    x = x0
+    value, grad = objective(x)
+    s_list, y_list = deque(maxlen=history), deque(maxlen=history)
+    for iteration in range(max_iter):
+        #two loop recursion to get the search direction
+        direction = -grad
+        alphas = []
+        for s, y in reversed(list(zip(s_list, y_list))):
+            alpha = s.dot(direction) / y.dot(s)
+            direction = direction - alpha*y
+            alphas.append(alpha)
+        if s_list:
+            direction = direction * (s_list[-1].dot(y_list[-1]) / y_list[-1].dot(y_list[-1]))
+        for (s, y), alpha in zip(zip(s_list, y_list), reversed(alphas)):
+            beta = y.dot(direction) / y.dot(s)
+            direction = direction + s*(alpha-beta)
+        slope = grad.dot(direction)
+        if slope >= 0: #not a descent direction, so forget the history and use steepest descent
+            s_list.clear()
+            y_list.clear()
+            direction, slope = -grad, -grad.dot(grad)
+        step = 1.0 if s_list else 1.0/max(1.0, np.sqrt(grad.dot(grad)))
+        #backtracking line search with the Armijo condition
+        for _ in range(40):
+            new_x = x + step*direction
+            new_value, new_grad = objective(new_x)
+            if new_value <= value + 1e-4*step*slope:
+                break
+            step *= 0.5
+        else:
+            break
+        s, y = new_x - x, new_grad - grad
+        if s.dot(y) > 1e-10:
+            s_list.append(s)
+            y_list.append(y)
+        converged = abs(value-new_value) <= tol*max(1.0, abs(value))
+        x, value, grad = new_x, new_value, new_grad
+        if converged:
+            break
+    return x
+
+
+class MaxEntModel:
+    def __init__(self, features, labels, weights=None, bias=None):
+        self.features = list(features) #column index: feature name
+        self.labels = list(labels) #label index: label
+        self.feat2index = {feat: index for index, feat in enumerate(self.features)}
+        self.label2index = {label: index for index, label in enumerate(self.labels)}
+        self.weights = weights if weights is not None else np.zeros((len(self.features), len(self.labels)))
+        self.bias = bias if bias is not None else np.zeros(len(self.labels))
+
+    def __str__(self):
+        return 'A MaxEnt model with {} features and {} labels'.format(len(self.features), len(self.labels))
+
+    def fit(self, indptr, indices, data, label_indices, prior_variance=1.0, max_iter=200):
+        '''
+        Trains the weights by minimising the negative log likelihood plus an L2 (gaussian prior) penalty.
+        :param indptr, indices, data: CSR matrix of training instances, columns as in self.features
+        :param label_indices: numpy array of the gold label index of each instance
+        '''
+        num_feats, num_labels = len(self.features), len(self.labels)
+        t_indptr, t_indices, t_data = csr_transpose(indptr, indices, data, num_feats)
+        gold = np.zeros((len(label_indices), num_labels))
+        gold[np.arange(len(label_indices)), label_indices] = 1
+
+        def objective(params):
+            weights, bias = params[:-num_labels].reshape(num_feats, num_labels), params[-num_labels:]
+            log_probs = log_softmax(csr_dot(indptr, indices, data, weights) + bias)
+            value = -(log_probs*gold).sum() + params.dot(params)/(2*prior_variance)
+            residual = np.exp(log_probs) - gold
+            grad_weights = csr_dot(t_indptr, t_indices, t_data, residual)
+            grad = np.concatenate([grad_weights.ravel(), residual.sum(axis=0)]) + params/prior_variance
+            return value, grad
+
+        params = lbfgs(objective, np.concatenate([self.weights.ravel(), self.bias]), max_iter=max_iter)
+        self.weights, self.bias = params[:-num_labels].reshape(num_feats, num_labels), params[-num_labels:]
+
+    def log_probs(self, indptr, indices, data):
+        #scores a whole batch of instances at once
+        return log_softmax(csr_dot(indptr, indices, data, self.weights) + self.bias)
+
+    def classify(self, indptr, indices, data):
+        '''
+        :return: numpy array of best label indices, 2D numpy array of label probabilities (instances x labels)
+        '''
+        probs = np.exp(self.log_probs(indptr, indices, data))
+        return probs.argmax(axis=1), probs
+
+    def save(self, filename):
+        np.savez(filename, weights=self.weights, bias=self.bias,
+                 features=np.array(self.features, dtype=str), labels=np.array(self.labels, dtype=str))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as model_data:
+            return cls(model_data['features'].tolist(), model_data['labels'].tolist(),
+                       model_data['weights'], model_data['bias'])
+
+
+def train_model(feature_lists, labels, value_lists=None, prior_variance=1.0, max_iter=200):
+    '''
+    :param feature_lists: list of lists of feature names, one per instance
+    :param labels: list of gold labels, one per instance
+    :return: a trained MaxEntModel
+    '''
+    features = list(dict.fromkeys(feat for feature_list in feature_lists for feat in feature_list))
+    model = MaxEntModel(features, sorted(set(labels)))
+    indptr, indices, data = build_csr(feature_lists, model.feat2index, value_lists)
+    label_indices = np.array([model.label2index[label] for label in labels], dtype=np.int64)
+    model.fit(indptr, indices, data, label_indices, prior_variance, max_iter)
+    return model
+
+
+def format_classifications(names, model, probs):
+    '''
+    :return: output lines in mallet classify-file format, labels in descending probability order
+    '''
+    output_lines = []
+    for name, row in zip(names, probs):
+        ranked = np.argsort(-row, kind='stable')
+        output_lines.append('\t'.join([name] + ['{}\t{}'.format(model.labels[i], row[i]) for i in ranked]))
+    return output_lines
+
+
+def accuracy(model, predictions, labels):
+    correct = sum(1 for pred, gold in zip(predictions, labels) if model.labels[pred] == gold)
+    return correct/len(labels) if labels else 0.0
+
+
+if __name__ == "__main__":
+    train_vector_file, test_vector_file, output_dir = sys.argv[1], sys.argv[2], sys.argv[3]
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    train_names, train_labels, train_feats, train_values = read_vector_file(train_vector_file)
+    model = train_model(train_feats, train_labels, train_values)
+    model.save(os.path.join(output_dir, 'me_model.npz'))
+    train_predictions, _ = model.classify(*build_csr(train_feats, model.feat2index, train_values))
+
+    test_names, test_labels, test_feats, test_values = read_vector_file(test_vector_file)
+    test_predictions, test_probs = model.classify(*build_csr(test_feats, model.feat2index, test_values))
+    with open(os.path.join(output_dir, 'sys_out'), 'w') as outfile:
+        outfile.write('\n'.join(format_classifications(test_names, model, test_probs)))
+
+    print('Summary. train accuracy mean = {}'.format(accuracy(model, train_predictions, train_labels)))
+    print('Summary. test accuracy mean = {}'.format(accuracy(model, test_predictions, test_labels)))
@@ -8,7 +8,16 @@ is called final train.vectors.
 4. Run mallet classify-file to get the result on the test data final test.vectors.txt.
 5. Calculate the test accuracy
 
-Command to run: maxent tagger.py train_file test_file rare_thres feat_thres output_dir
+Command to run: maxent tagger.py train_file test_file rare_thres feat_thres output_dir [--procs N] [--cache-dir DIR]
+
+--procs N runs parts 2, 4 and 5 below over shards of sentences in a pool of N processes. The per shard feature
+Counters are merged before pruning and the shard outputs are concatenated in order, so the files are byte for byte the
+same as with one process.
+
+--cache-dir DIR keeps train_voc, the train features (before pruning) and the test features in DIR, keyed by a hash of the
+input files and rare_thres. Runs that sweep thresholds then only redo the pruning and output steps for each feat_thres.
+The two work together: with --procs the merged train feature counts are cached (the pool mode doesn't build the whole
+feature store), and parts 4 and 5 are still done by the pool.
 
 1. create train_voc from the train_file, and use the word frequency in train_voc and rare_thres to
 determine whether a word should be treated as a rare word. This changes the feature vectors.
@@ -22,16 +31,24 @@ the string itself.
 4. Go through the feature vector file for train_file and REMOVE all the features that are not in
 kept_feats.
 
+Steps 2-4 at the top can also be done without mallet (or java): maxent_tagger_native.sh runs this script and then
+maxent_model.py, which trains and classifies in-process with numpy.
+
 
 
 
 '''
-import sys
 import re
-from collections import Counter, defaultdict
+from collections import Counter
+from array import array
 
 import os
-import subprocess
+import sys
+import argparse
+import hashlib
+import pickle
+from functools import lru_cache
+from multiprocessing import Pool
 
 
 def process_sentence(input, regex):
@@ -65,107 +82,284 @@ def make_voc(word_list):
     del voc_dict['EOS']
     return voc_dict
 
-def generate_feature_vectors(input_sentences, voc_dict, rare_thres):
+def context_word_features(sentence, word_tag_i):
+    '''
+    :param sentence: list of (word, tag) tuples with BOS and EOS padding
+    :param word_tag_i: index of the current word in the sentence
+    :return: prevW, prev2W, nextW, next2W features. These only depend on the words, never the tags
+    '''
+    prevW, prev2W = 'prevW={}'.format(sentence[word_tag_i-1][0]), 'prev2W={}'.format(sentence[word_tag_i-2][0])
+    nextW, next2W = 'nextW={}'.format(sentence[word_tag_i+1][0]), 'next2W={}'.format(sentence[word_tag_i+2][0])
+    return prevW, prev2W, nextW, next2W
+
+def tag_features(prev2_tag, prev_tag):
+    #the only features that need the tag history, so the only ones a decoder has to recompute per hypothesis
+    return 'prevT={}'.format(prev_tag), 'prevTwoTags={}+{}'.format(prev2_tag, prev_tag)
+
+def current_word_features(curW, voc_dict, rare_thres):
+    '''
+    :return: list of features of the current word. curW for non rare words, otherwise containUC, containNum,
+    containHyp and prefixes and suffixes up to length 4
+    '''
+    features = []
+    # grab features for rare words, if word is rare
+    if voc_dict[curW] < rare_thres:
+        if curW[0].isupper():
+            features.append('containUC')
+        if re.search(r'\d', curW): #if no digits, will return None
+            features.append('containNum')
+        if re.search(r'-', curW):
+            features.append('containHyp')
+        #generate affix features for the current word
+        #maximum length for prefix and suffix is 4, unless words are shorter
+        if len(curW) >= 4:
+            end = 5
+        else:
+            end = len(curW)
+        for index in range(1, end):
+            pref = 'pref={}'.format(curW[:index])
+            suf = 'suf={}'.format(curW[-index:])
+            features.extend([pref, suf])
+    else:
+        #add curW to features
+        features.append('curW={}'.format(curW))
+    return features
+
+class FeatureStore:
+    '''
+    A compact store of the features of every token in a corpus, replacing a defaultdict(set) keyed by
+    (sent_num, word_num, word, tag). On a whole treebank that dict was most of the memory: a tuple, a set and a hash
+    table per token. Here features, words and tags are interned to int ids once, and each token is just a slice
+    feature_ids[offsets[i]:offsets[i+1]] of one flat int32 array plus an entry in the parallel per token arrays.
+    '''
+    def __init__(self):
+        self.features, self.feature2id = [], {} #id: feature string, feature string: id
+        self.words, self.word2id = [], {}
+        self.tags, self.tag2id = [], {}
+        self.feature_ids = array('i')
+        self.offsets = array('q', [0])
+        self.sent_nums, self.word_nums = array('i'), array('i')
+        self.word_ids, self.tag_ids = array('i'), array('i')
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def __str__(self):
+        return 'A FeatureStore of {} tokens and {} distinct features'.format(len(self), len(self.features))
+
+    @staticmethod
+    def intern(item, item2id, items):
+        item_id = item2id.get(item)
+        if item_id is None:
+            item_id = item2id[item] = len(items)
+            items.append(item)
+        return item_id
+
+    def add_token(self, sent_num, word_num, word, tag, features):
+        #features are stored once each, in the order they were generated
+        seen = set()
+        for feature in features:
+            feature_id = self.intern(feature, self.feature2id, self.features)
+            if feature_id not in seen:
+                seen.add(feature_id)
+                self.feature_ids.append(feature_id)
+        self.offsets.append(len(self.feature_ids))
+        self.sent_nums.append(sent_num)
+        self.word_nums.append(word_num)
+        self.word_ids.append(self.intern(word, self.word2id, self.words))
+        self.tag_ids.append(self.intern(tag, self.tag2id, self.tags))
+
+    def key(self, token):
+        #the (sent_num, word_num, word, tag) key of the old dict
+        return (self.sent_nums[token], self.word_nums[token], self.words[self.word_ids[token]],
+                self.tags[self.tag_ids[token]])
+
+    def token_feature_ids(self, token):
+        return self.feature_ids[self.offsets[token]:self.offsets[token+1]]
+
+    def token_features(self, token):
+        return [self.features[feature_id] for feature_id in self.token_feature_ids(token)]
+
+def generate_feature_vectors(input_sentences, voc_dict, rare_thres, sentence_offset=0):
     #generates feature vectors for a single sentence
-    #word_label_features is a defaultdict of with key (index, word_label pair) and set of feature vectors
+    #word_label_features is a FeatureStore of (sent_num, word_num, word, tag) and the features of each token in the
+    #order they were generated (so output order doesn't depend on string hashing)
+    #sentence_offset is the index of input_sentences[0] in the whole corpus, for when this is run on a shard
     #for all words: t_i-1, (t_i-2, t_i-1), w_i-1, w_i-2, w_i+1, w_i+2
     #for non rare words: w_i
     #for rare words: w_i has prefix X, w_i has suffix X, both where X <= 4
     #w_i contains number, w_i contains uppercase, w_i contains hyphen
 
-    word_label_features = defaultdict(set)
+    word_label_features = FeatureStore()
     feature_vecs = Counter()
 
     for sentence_index in range(len(input_sentences)):
         sentence = input_sentences[sentence_index]
         for word_tag_i in range(2, len(sentence)-2):
-            features = []
             #grab features for all words
-            prevW, prevT = 'prevW={}'.format(sentence[word_tag_i-1][0]), 'prevT={}'.format(sentence[word_tag_i-1][1])
-            prev2W = 'prev2W={}'.format(sentence[word_tag_i-2][0])
-            prevTwoTags = 'prevTwoTags={}+{}'.format(sentence[word_tag_i-2][1], sentence[word_tag_i-1][1])
-            nextW, next2W =  'nextW={}'.format(sentence[word_tag_i+1][0]), 'next2W={}'.format(sentence[word_tag_i+2][0])
+            prevW, prev2W, nextW, next2W = context_word_features(sentence, word_tag_i)
+            prevT, prevTwoTags = tag_features(sentence[word_tag_i-2][1], sentence[word_tag_i-1][1])
             #add features to list:
-            features.extend([prevW, prevT, prev2W, prevTwoTags, nextW, next2W])
+            features = [prevW, prevT, prev2W, prevTwoTags, nextW, next2W]
 
             curW, curT = sentence[word_tag_i]
-            # grab features for rare words, if word is rare
-            if voc_dict[curW] < rare_thres:
-                if curW[0].isupper():
-                    features.append('containUC')
-                if re.search(r'\d', curW): #if no digits, will return None
-                    features.append('containNum')
-                if re.search(r'-', curW):
-                    features.append('containHyp')
-                #generate affix features for the current word
-                #maximum length for prefix and suffix is 4, unless words are shorter
-                if len(curW) >= 4:
-                    end = 5
-                else:
-                    end = len(curW)
-                for index in range(1, end):
-                    pref = 'pref={}'.format(curW[:index])
-                    suf = 'suf={}'.format(curW[-index:])
-                    features.extend([pref, suf])
-            else:
-                #add curW to features
-                features.append('curW={}'.format(curW))
-            #add everything to a the word_label dict and to the feature_vecs counter
+            features.extend(current_word_features(curW, voc_dict, rare_thres))
+            #add everything to a the word_label store and to the feature_vecs counter
             for feature in features:
                 feature_vecs[feature] += 1
-                key = (sentence_index+1, word_tag_i-2, curW, curT) #start counting sentences from 1, start counting words from first real word (skip BOS's)
-                word_label_features[key].add(feature)
+            #start counting sentences from 1, start counting words from first real word (skip BOS's)
+            word_label_features.add_token(sentence_offset+sentence_index+1, word_tag_i-2, curW, curT, features)
     return feature_vecs, word_label_features
 
-def get_feature_vector_output(input_sentences, feature_vectors, word_label_feat_dict):
+def get_feature_vector_output(feature_vectors, word_label_features):
     '''
-    takes a nested list of sentences of word, tag tuples, progresses through the list and grabs the relevant
-    feature vector information for each word based on the pre-made word_label_feat_dict
-    :param train_inputlines: nested list of sentences of (word, tag) tuples
+    progresses through the tokens of a FeatureStore (in corpus order) and formats each one's feature vector
+    information, keeping only the features in feature_vectors
     :param feature_vectors: a Counter of feature_vector: count of how many times it appeared in training. Determines
     which of all vectors we will keep in the final file
-    :param word_label_feat_dict: a pre-made dict of (sent_num, word_num, word, tag) : feature vectors
+    :param word_label_features: a FeatureStore made by generate_feature_vectors
     :return: formatted string output to write a file
     '''
     output_lines = []
     #for replacing commas with "comma" because mallet is dumb and , is a delimiter
     comma = re.compile(r',')
-    for sentence_index in range(len(input_sentences)):
-        sentence = input_sentences[sentence_index]
-        for word_tag_i in range(2, len(sentence)-2):
-            curW, curT = sentence[word_tag_i]
-            key = (sentence_index + 1, word_tag_i - 2, curW, curT)
-            features = word_label_feat_dict[key]
-            #restrict to only features in given Counter
-            kept_features = comma.sub('comma', ' 1 '.join(set(features) & set(feature_vectors)))
-            output_line = comma.sub('comma','{}-{}-{} {} {} 1'.format(key[0], key[1], key[2], key[3], kept_features))
-            output_lines.append(output_line)
+    #look each feature id up in feature_vectors once, rather than each feature string once per token
+    features = word_label_features.features
+    kept_ids = bytearray(feature in feature_vectors for feature in features)
+    for token in range(len(word_label_features)):
+        key = word_label_features.key(token)
+        #restrict to only features in given Counter. Keeps the generated order, so the output is reproducible
+        kept_features = comma.sub('comma', ' 1 '.join([features[feature_id] for feature_id in
+                                                       word_label_features.token_feature_ids(token)
+                                                       if kept_ids[feature_id]]))
+        output_line = comma.sub('comma','{}-{}-{} {} {} 1'.format(key[0], key[1], key[2], key[3], kept_features))
+        output_lines.append(output_line)
     output_data = '\n'.join(output_lines)
     return output_data
 
 
+def read_sentences(input_file, regex):
+    #list of tuples of (word, tag), one list per sentence
+    with open(input_file, 'r') as infile:
+        return [process_sentence(line, regex) for line in infile]
+
+#bump this if feature extraction changes, so old cached artifacts are not reused
+CACHE_VERSION = 1
+
+def file_hash(input_file):
+    sha = hashlib.sha256()
+    with open(input_file, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def cached(cache_dir, key, compute):
+    '''
+    Content addressed cache of intermediate artifacts. The file name is a hash of the key, so the key has to hold
+    everything the artifact depends on (input file hashes and parameters).
+    :param key: tuple of the artifact name, input file hashes and parameters
+    :param compute: function with no args that makes the artifact if it is not cached
+    :return: the artifact. If it can't be written to cache_dir (read only or full) it is still returned, just not cached
+    '''
+    digest = hashlib.sha256(repr((CACHE_VERSION,) + key).encode()).hexdigest()
+    cache_file = os.path.join(cache_dir, '{}-{}.pkl'.format(key[0], digest))
+    if os.path.exists(cache_file):
+        with open(cache_file, 'rb') as infile:
+            return pickle.load(infile)
+    artifact = compute()
+    #write then rename, so parallel (condor) jobs never read a half written file
+    temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temp_file, 'wb') as outfile:
+            pickle.dump(artifact, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError as error:
+        print('Not caching {}: {}'.format(key[0], error), file=sys.stderr)
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    return artifact
+
+def shard_sentences(input_sentences, num_shards):
+    '''
+    :return: list of (sentence_offset, list of sentences) contiguous shards, in corpus order
+    '''
+    shard_size = max(1, -(-len(input_sentences) // num_shards)) #ceiling division
+    return [(start, input_sentences[start:start+shard_size]) for start in range(0, len(input_sentences), shard_size)]
+
+#each pool worker gets the vocabulary etc once through the initializer instead of once per shard
+worker_data = {}
+
+def init_worker(voc_dict, rare_thres, kept_features=None):
+    worker_data['voc_dict'], worker_data['rare_thres'] = voc_dict, rare_thres
+    worker_data['kept_features'] = kept_features
+
+def count_shard_features(shard):
+    sentence_offset, sentences = shard
+    feature_vecs, _ = generate_feature_vectors(sentences, worker_data['voc_dict'], worker_data['rare_thres'],
+                                               sentence_offset)
+    return feature_vecs
+
+def shard_vector_output(shard):
+    #features are regenerated in the worker rather than shipping the word_label store between processes
+    sentence_offset, sentences = shard
+    _, word_label_features = generate_feature_vectors(sentences, worker_data['voc_dict'], worker_data['rare_thres'],
+                                                      sentence_offset)
+    return get_feature_vector_output(worker_data['kept_features'], word_label_features)
+
+def merge_shard_counts(shard_counts):
+    #Counter.update keeps first seen order, so most_common() ties come out exactly as in the sequential version
+    feature_vecs = Counter()
+    for counts in shard_counts:
+        feature_vecs.update(counts)
+    return feature_vecs
+
+def join_shard_outputs(shard_outputs):
+    #shards with no words give empty strings, which would otherwise add blank lines
+    return '\n'.join([output for output in shard_outputs if output])
+
+
 if __name__ == "__main__":
-    train_filename, test_filename = sys.argv[1], sys.argv[2]
-    rare_thres, feat_thres = int(sys.argv[3]), int(sys.argv[4])
-    output_dir = sys.argv[5]
+    parser = argparse.ArgumentParser(description='Creates MaxEnt POS tagging feature vectors for mallet')
+    parser.add_argument('train_file')
+    parser.add_argument('test_file')
+    parser.add_argument('rare_thres', type=int)
+    parser.add_argument('feat_thres', type=int)
+    parser.add_argument('output_dir')
+    parser.add_argument('--procs', type=int, default=1,
+                        help='number of processes for parts 2, 4 and 5. The output is identical for any value')
+    parser.add_argument('--cache-dir',
+                        help='directory to cache the vocabulary and feature vectors in, to share between runs')
+    args = parser.parse_args()
+    train_filename, test_filename = args.train_file, args.test_file
+    rare_thres, feat_thres = args.rare_thres, args.feat_thres
+    output_dir = args.output_dir
+    procs = args.procs
+    cache_dir = args.cache_dir
+    num_shards = procs*4 #a few shards per process to even out the load
 
     #check if output_dir exists, if not, create it
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
+    if cache_dir:
+        #features depend on the vocabulary, so on the train file, as well as on rare_thres. feat_thres only matters
+        #from part 3 on, so every feat_thres with the same rare_thres shares the cached features
+        train_hash = file_hash(train_filename)
 
     ####Part 1
     #process training file
     regex_obj = re.compile(r'(?<!\\)/')
-    # list of tuples of (word, tag), one list per sentence
-    train_inputlines = []
-    with open(train_filename, 'rU') as infile:
-        for line in infile:
-            train_inputlines.append(process_sentence(line, regex_obj))
-    # extract words from input lines
-    words = [item[0] for sentence in train_inputlines for item in sentence]
-
-    #generate vocabulary from words
-    vocabulary = make_voc(words)
+    # list of tuples of (word, tag), one list per sentence. Read on first use, so not at all if everything is cached
+    get_train_inputlines = lru_cache(maxsize=None)(lambda: read_sentences(train_filename, regex_obj))
+    def train_vocabulary():
+        # extract words from input lines
+        words = [item[0] for sentence in get_train_inputlines() for item in sentence]
+        #generate vocabulary from words
+        return make_voc(words)
+    if cache_dir:
+        vocabulary = cached(cache_dir, ('train_voc', train_hash), train_vocabulary)
+    else:
+        vocabulary = train_vocabulary()
     #write a file with vocab
     voc_output = '\n'.join(['{} {}'.format(key, val) for key, val in vocabulary.most_common()])
     with open(output_dir + '/train_voc', 'w') as outfile:
@@ -173,7 +367,25 @@ if __name__ == "__main__":
 
     ####Part 2
     #generate feature vectors
-    feature_vectors, word_label_feat_dict = generate_feature_vectors(train_inputlines, vocabulary, rare_thres)
+    if procs > 1:
+        #the pool mode never builds the whole feature store, so only the merged shard counts are cached. Parts 4
+        #and 5 regenerate the features in the workers either way
+        def train_feature_counts():
+            train_shards = shard_sentences(get_train_inputlines(), num_shards)
+            with Pool(procs, init_worker, (vocabulary, rare_thres)) as pool:
+                return merge_shard_counts(pool.imap(count_shard_features, train_shards))
+        if cache_dir:
+            feature_vectors = cached(cache_dir, ('train_counts', train_hash, rare_thres), train_feature_counts)
+        else:
+            feature_vectors = train_feature_counts()
+    elif cache_dir:
+        #part 3 deletes from feature_vectors, but the cached copy was written before that
+        feature_vectors, word_label_feat_dict = cached(cache_dir, ('train_feats', train_hash, rare_thres), lambda:
+                                                       generate_feature_vectors(get_train_inputlines(), vocabulary,
+                                                                                rare_thres))
+    else:
+        feature_vectors, word_label_feat_dict = generate_feature_vectors(get_train_inputlines(), vocabulary,
+                                                                         rare_thres)
     init_feat_output = '\n'.join(['{} {}'.format(key, val) for key, val in feature_vectors.most_common()])
     with open(output_dir + '/init_feats', 'w') as outfile:
         outfile.write(init_feat_output)
@@ -196,21 +408,35 @@ if __name__ == "__main__":
 
     ####Part 4
     #generate train file based on pruned features
-    train_output = get_feature_vector_output(train_inputlines, feature_vectors, word_label_feat_dict)
+    if procs > 1:
+        #one pool for parts 4 and 5, since both need the same kept features
+        pool = Pool(procs, init_worker, (vocabulary, rare_thres, feature_vectors))
+        train_output = join_shard_outputs(pool.imap(shard_vector_output,
+                                                    shard_sentences(get_train_inputlines(), num_shards)))
+    else:
+        train_output = get_feature_vector_output(feature_vectors, word_label_feat_dict)
     with open(output_dir + '/final_train.vectors.txt', 'w') as outfile:
         outfile.write(train_output)
 
     ####Part 5
     #generate test_file based on pruned features
     #This is a repeat of step 4 but with the test file
-    test_inputlines = []
-    with open(test_filename, 'rU') as infile:
-            for line in infile:
-                test_inputlines.append(process_sentence(line, regex_obj))
-
-    test_feature_vectors, test_word_label_feat_dict = generate_feature_vectors(test_inputlines, vocabulary, rare_thres)
-    #don't actually need to use test_feature_vectors since we will be using feature_vectors from training.
-    test_output = get_feature_vector_output(test_inputlines, feature_vectors, test_word_label_feat_dict)
+    if procs > 1:
+        test_inputlines = read_sentences(test_filename, regex_obj)
+        test_output = join_shard_outputs(pool.imap(shard_vector_output, shard_sentences(test_inputlines, num_shards)))
+        pool.close()
+        pool.join()
+    elif cache_dir:
+        #the test features depend on the train vocabulary too
+        test_word_label_feat_dict = cached(cache_dir, ('test_feats', file_hash(test_filename), train_hash, rare_thres),
+                                           lambda: generate_feature_vectors(read_sentences(test_filename, regex_obj),
+                                                                            vocabulary, rare_thres)[1])
+        test_output = get_feature_vector_output(feature_vectors, test_word_label_feat_dict)
+    else:
+        test_inputlines = read_sentences(test_filename, regex_obj)
+        test_feature_vectors, test_word_label_feat_dict = generate_feature_vectors(test_inputlines, vocabulary, rare_thres)
+        #don't actually need to use test_feature_vectors since we will be using feature_vectors from training.
+        test_output = get_feature_vector_output(feature_vectors, test_word_label_feat_dict)
 
     with open(output_dir + '/final_test.vectors.txt', 'w') as outfile:
             outfile.write(test_output)
@@ -0,0 +1,6 @@
+#!/bin/sh
+
+#same as maxent_tagger.sh, but trains and classifies with maxent_model.py instead of mallet (no java needed)
+python3 maxent_tagger.py $@
+
+python3 maxent_model.py $5/final_train.vectors.txt $5/final_test.vectors.txt $5 > $5/me_model.stdout 2> $5/me_model.stderr
@@ -8,7 +8,7 @@ do
     rare=${thres:0:1}
     feat=${thres:2:1}
     echo running tagger with threshold $thres
-    eval ./maxent_tagger.sh examples/wsj_sec0.word_pos examples/test.word_pos $rare $feat res_$thres
+    eval ./maxent_tagger.sh examples/wsj_sec0.word_pos examples/test.word_pos $rare $feat res_$thres --cache-dir cache
     end='date +%s'
     runtime=$((end-start))
     echo $runtime
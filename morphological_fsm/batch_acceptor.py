@@ -0,0 +1,105 @@
+'''
+Accepts a whole word list at once with a determinized FSM and numpy.
+
+morph_acceptor1.py walks the DFA one word and one character at a time in python. Here the DFA becomes a dense
+(state x symbol) table of next states, the words become a padded array of symbol ids (one row per word), and all the
+words take each step together: states = table[states, symbol_ids[:, step]] is one fancy indexing call per character
+position instead of one dict lookup and bisect per character.
+- row num_states of the table is a dead state that every missing arc goes to (and that loops on every symbol), and the
+last column is for characters the FSM has no arc on, so there are no special cases in the loop
+- the words are sorted longest first, so at step i the words still being read are the first rows and a shorter word's
+state isn't moved by its padding
+- the words are encoded by viewing a numpy unicode array as its code points and looking those up in a code point to
+symbol id array, so there is no python loop per character either
+- the list is done in chunks, which bounds the size of the padded array
+
+Command to run: batch_acceptor.py fsm word_list output_file
+Same arguments and output file as morph_acceptor1.py. Prints the number of words accepted and the time taken.
+'''
+
+import sys
+import time
+
+import numpy as np
+
+from fsa_ops import FSA, determinize
+from morph_acceptor1 import read_words
+
+
+class DenseDFA:
+    def __init__(self, dfa):
+        '''
+        :param dfa: a deterministic FSA (e.g. from fsa_ops.determinize or minimize)
+        '''
+        self.num_states = dfa.num_states
+        self.dead = dfa.num_states
+        self.initial = dfa.initial
+        num_symbols = len(dfa.symbols)
+        self.unknown = num_symbols
+        self.table = np.full((dfa.num_states+1, num_symbols+1), self.dead, dtype=np.int32)
+        for state in range(dfa.num_states):
+            for label, next_state in dfa.arcs(state):
+                self.table[state, label] = next_state
+        self.final = np.zeros(dfa.num_states+1, dtype=bool)
+        self.final[list(dfa.finals)] = True
+        #code point: symbol id, for the single character symbols. Anything else is unknown
+        char_symbols = {ord(symbol): label for label, symbol in enumerate(dfa.symbols) if len(symbol) == 1}
+        self.code2id = np.full(max(char_symbols, default=0)+1, self.unknown, dtype=np.int32)
+        for code, label in char_symbols.items():
+            self.code2id[code] = label
+
+    def __str__(self):
+        return 'A dense DFA table of {} x {}'.format(*self.table.shape)
+
+    def encode(self, words):
+        '''
+        :param words: list of strings
+        :return: 2D numpy array (words x longest word) of symbol ids (padding is unknown), numpy array of word lengths
+        '''
+        if not words:
+            return np.zeros((0, 0), dtype=np.int32), np.zeros(0, dtype=np.int64)
+        word_array = np.array(words, dtype=str)
+        lengths = np.char.str_len(word_array).astype(np.int64)
+        codes = word_array.view(np.uint32).reshape(len(words), -1)[:, :lengths.max()]
+        symbol_ids = self.code2id[np.minimum(codes, len(self.code2id)-1)]
+        symbol_ids[codes >= len(self.code2id)] = self.unknown
+        return symbol_ids, lengths
+
+    def run(self, words, chunk_size=65536):
+        '''
+        :param words: list of strings
+        :return: numpy array of accept flags and numpy array of the state each word ends in (-1 if it fell off the DFA)
+        '''
+        accepted = np.zeros(len(words), dtype=bool)
+        end_states = np.full(len(words), -1, dtype=np.int64)
+        for start in range(0, len(words), chunk_size):
+            symbol_ids, lengths = self.encode(words[start:start+chunk_size])
+            order = np.argsort(-lengths, kind='stable')
+            symbol_ids, lengths = symbol_ids[order], lengths[order]
+            #active[i] is the number of words longer than i
+            active = np.searchsorted(-lengths, -np.arange(symbol_ids.shape[1]), side='left')
+            states = np.full(len(order), self.initial, dtype=np.int32)
+            for step, num_active in enumerate(active):
+                states[:num_active] = self.table[states[:num_active], symbol_ids[:num_active, step]]
+                if (states[:num_active] == self.dead).all():
+                    break
+            chunk_states = np.empty_like(states)
+            chunk_states[order] = states
+            accepted[start:start+len(order)] = self.final[chunk_states]
+            end_states[start:start+len(order)] = np.where(chunk_states == self.dead, -1, chunk_states)
+        return accepted, end_states
+
+
+if __name__ == "__main__":
+    fsm = sys.argv[1]
+    input_file = sys.argv[2]
+    output_file = sys.argv[3]
+    dense_dfa = DenseDFA(determinize(FSA.from_file(fsm)))
+    words = read_words(input_file)
+    start = time.perf_counter()
+    accepted, _ = dense_dfa.run(words)
+    print('{} of {} words accepted in {:.3f}s'.format(accepted.sum(), len(words), time.perf_counter()-start),
+          file=sys.stderr)
+    with open(output_file, 'w') as outfile:
+        for word, accept in zip(words, accepted):
+            outfile.write(word+' => '+('yes' if accept else 'no')+'\n')
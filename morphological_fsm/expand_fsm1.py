@@ -16,67 +16,67 @@ proper expansion is something like this
 (q0si (q0sin n))
 (q0sin (q2 g))
 
-To Do:
-***important to be careful about naming the states since there will be loads.
+(the states are actually numbered, and words with the same prefix share its states, see expand_fsm)
+
 Make sure if there is ambiguity we just enumerate all possibilities
 '''
 
+import os
 import sys
 from collections import defaultdict
+from itertools import count
 
-import re
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'finite_state_transducers'))
+from carmel_format import read_carmel
 
 
 def expand_fsm(morph_fsm,lexicon):
     '''
+    Each (from state, class label) rule gets a prefix trie of the words with that label, so words that share a prefix
+    share the states for it, and the output grows with the number of distinct prefixes rather than the total number of
+    characters. The trie states are numbered rather than named after the characters, skipping any number that is
+    already a state name in the rules.
     :param morph_fsm: an fsm of morph rules, initial state, final state, transitions dict
     :param lexicon: a lexicon list made with import_lexicon function
-    :return: an expanded fsm. Currently does not do any minimisation
+    :return: an expanded fsm. Words with the same class label and from state share their prefix states (a trie)
     '''
-    start_state, final_state, existing_states = morph_fsm[1],morph_fsm[0],set()
-    # existing states to track states that are already being used to prevent naming collisions
+    start_state, final_state = morph_fsm[1], morph_fsm[0]
+    rule_states = {start_state, final_state}
+    for label_transitions in morph_fsm[2].values():
+        for from_state, to_states in label_transitions.items():
+            rule_states.add(from_state)
+            rule_states.update(to_states)
+    state_ids = (str(state_id) for state_id in count() if str(state_id) not in rule_states)
+    trie = {} #(class label, state, char): next state. The root of each trie is the rule's from state
+    final_arcs = set() #so a word listed twice doesn't add its final arcs twice
     output_list = []
     output_list.append(final_state)
     output_list.append('({} ({} *e*))'.format(start_state,start_state)) #this ensures that the start state comes first
     for entry in lexicon:
         word, class_label = entry[0], entry[1]
-        try:
-            transitions = morph_fsm[2][class_label].items() #will return a list of tuples of (from state,list of to states)
-            for transition in transitions: #loop through the list of returned transitions
-                from_state, to_states = transition[0], transition[1] #remember that to_state might be a list
-                existing_states.add(from_state)
-                [existing_states.add(next) for next in to_states]
-                for char in word[:-1]:       #loop through word expanding the fsm for each character
-                    next_state = from_state+char #next state name is the from state + the next character
-                    if next_state in existing_states: #check uniqueness to prevent collisions of state names
-                        unique_state = False
-                        count = 0
-                        while not unique_state:
-                            next_state = next_state+str(count)
-                            if next_state not in existing_states:
-                                unique_state = True
-                            count+=1
-                    output_list.append('({} ({} {}))'.format(from_state, next_state, char))
-                    existing_states.add(next_state)
-                    from_state = next_state
-                #print final transition from last char to the to_state
-                for to_state in to_states:
-                    output_list.append('({} ({} {}))'.format(from_state, to_state, word[-1:]))
-        except KeyError:
+        if class_label not in morph_fsm[2]:
             print('{} was not in morphotactic fsm rules'.format(class_label), file=sys.stderr)
-        #need to also account for epsilon transitions
-    try:
-        epsilon_transitions = morph_fsm[2]['*e*'].items()
-        for transition in epsilon_transitions:  #yes this is copy pasted so it should be a function... but oh well for now
-            e_from_state, e_to_states = transition[0], transition[1] #remember could be list
-            for e_to_state in e_to_states:
-                output_list.append('({} ({} {}))'.format(e_from_state, e_to_state, '*e*'))
-
-    except KeyError:
-        pass
+            continue
+        for from_state, to_states in morph_fsm[2][class_label].items(): #remember that to_states is a list
+            #walk (or extend) the trie through the word, except the final char
+            for char in word[:-1]:
+                next_state = trie.get((class_label, from_state, char))
+                if next_state is None:
+                    next_state = trie[(class_label, from_state, char)] = next(state_ids)
+                    output_list.append('({} ({} {}))'.format(from_state, next_state, char))
+                from_state = next_state
+            #final transition from last char to the to_state
+            for to_state in to_states:
+                arc = '({} ({} {}))'.format(from_state, to_state, word[-1:])
+                if arc not in final_arcs:
+                    final_arcs.add(arc)
+                    output_list.append(arc)
+    #need to also account for epsilon transitions
+    for e_from_state, e_to_states in morph_fsm[2].get('*e*', {}).items():
+        for e_to_state in e_to_states: #remember could be list
+            output_list.append('({} ({} {}))'.format(e_from_state, e_to_state, '*e*'))
     return output_list
 
-
 def import_morphotactics(file):
     '''
     builds a dict of morphotactic rules. A little different than in the past, since we want to look up by class label
@@ -85,27 +85,16 @@ def import_morphotactics(file):
     :param file: a file of morphotactic rules in carmel format. E.g. (q0 (q3 irreg_past_verb_form)). One rule per line.
     :return: dict of morphotactic rules in this format
     '''
-    line_list = []
-    with open(file, 'rU') as file:
-        line_list = [line.strip() for line in skip_pycomments(file)]
-
-    final_states = line_list[0]  # only accepts one final state
-    initial_state = replace_parens(line_list[1])[0]  # grabs first element of the list returned as carmel files
-    # specify start state as first state in second line of file
+    #streamed and tokenized by the carmel reader shared with the FST scripts (finite_state_transducers/carmel_format.py)
+    arcs = read_carmel(file, 1)
+    final_states = next(arcs)  # only accepts one final state
+    initial_state = None
     # time to build the transitions dict
     transitions = defaultdict(defaultdict)
-    for line in line_list[1:]:
-        if line:
-            new_trans = replace_parens(line)
-            state, label, next_state = new_trans[0], new_trans[2], new_trans[1]
-            if not transitions[label]: #if label not in dict then assign a new dict of lists
-                transitions[label] = {state:[next_state]} #make sure these dictionary assignments work
-            else:
-                try:
-                    if transitions[label][state]: #check next layer of nesting
-                        transitions[label][state].append(next_state)
-                except KeyError:
-                    transitions[label][state] = [next_state]
+    for state, next_state, (label,), weight in arcs:
+        if initial_state is None:
+            initial_state = state  # carmel files specify start state as first state in second line of file
+        transitions[label].setdefault(state, []).append(next_state)
 
     return [final_states, initial_state, transitions]
 
@@ -116,7 +105,7 @@ def import_lexicon(file):
     :param file: the name/path to a file one word and classlabel per line whitespace separated
     :return: dict of word:classlabel
     '''
-    with open(file, 'rU') as file:
+    with open(file, 'r') as file:
         lexicon_list = []
         count = 1 #for error use
         for line in file:
@@ -130,16 +119,6 @@ def import_lexicon(file):
             count += 1
     return lexicon_list
 
-def skip_pycomments(input):
-    for line in input:
-        line = line.strip()
-        if line:
-            if not line.lstrip().startswith('#'):
-                yield line
-
-def replace_parens(line):
-    return re.sub('(\)|\()',' ',line).split()
-
 
 if __name__ == "__main__":
     lexicon = import_lexicon(sys.argv[1])
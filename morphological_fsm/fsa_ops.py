@@ -0,0 +1,262 @@
+'''
+Determinization and minimization for the FSAs made by expand_fsm1.py.
+
+The expanded FSA is nondeterministic: the *e* arcs from the *e* rules, and a word in several classes (or a class with
+several from states) starts several paths with the same character. Checking a word means tracking a set of states
+(carmel does this for every word). Here the FSA is compiled to integer states and symbols with CSR arcs, then:
+- determinize: subset construction with epsilon closure, so the result has no *e* arcs and at most one arc per symbol
+from each state
+- minimize: Hopcroft's partition refinement, which merges the states with the same future (e.g. the ends of all the
+words of a class). States that can't reach a final state are dropped
+After that accepting a word is one deterministic walk, one arc lookup per character (FSA.accepts).
+
+Command to run: fsa_ops.py fsa_file output_fsa [word_list]
+Writes the minimal DFA to output_fsa in carmel format and prints the state and arc counts of each step. With word_list,
+also prints "word => yes/no" for each word, like morph_acceptor1.py. fsa_report.py reports on a scaled up lexicon.
+'''
+
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'finite_state_transducers'))
+from carmel_format import read_carmel
+
+EPSILON = '*e*'
+
+
+class FSA:
+    def __init__(self, num_states, symbols, initial, finals, arc_offsets, arc_labels, arc_next):
+        '''
+        :param num_states: states are 0..num_states-1
+        :param symbols: list of symbols, indexed by symbol id
+        :param initial: initial state id
+        :param finals: set of final state ids
+        The arcs of state s are arc_offsets[s]:arc_offsets[s+1], sorted by label (symbol id), with arc_next the states
+        they go to
+        '''
+        self.num_states, self.symbols = num_states, symbols
+        self.symbol2id = {symbol: symbol_id for symbol_id, symbol in enumerate(symbols)}
+        self.initial, self.finals = initial, finals
+        self.arc_offsets, self.arc_labels, self.arc_next = arc_offsets, arc_labels, arc_next
+
+    def __str__(self):
+        return 'An FSA with {} states and {} arcs'.format(self.num_states, len(self.arc_next))
+
+    @classmethod
+    def from_arcs(cls, num_states, symbols, initial, finals, arcs):
+        #arcs: list of (state, label, next state)
+        arcs = sorted(set(arcs))
+        arc_offsets = array('i', [0])*(num_states+1)
+        for state, label, next_state in arcs:
+            arc_offsets[state+1] += 1
+        for state in range(num_states):
+            arc_offsets[state+1] += arc_offsets[state]
+        return cls(num_states, symbols, initial, finals, arc_offsets, array('i', (arc[1] for arc in arcs)),
+                   array('i', (arc[2] for arc in arcs)))
+
+    @classmethod
+    def from_file(cls, input_file):
+        #a carmel FSA file (one symbol per arc), like the output of expand_fsm1.py
+        arcs = read_carmel(input_file, 1)
+        final_state = next(arcs)
+        state2id, symbols, symbol2id, arc_list = {}, [], {}, []
+
+        def intern(label, label2id, labels=None):
+            if label not in label2id:
+                label2id[label] = len(label2id)
+                if labels is not None:
+                    labels.append(label)
+            return label2id[label]
+
+        for state, next_state, (label,), weight in arcs:
+            arc_list.append((intern(state, state2id), intern(label, symbol2id, symbols), intern(next_state, state2id)))
+        initial = 0 #the first state of the first arc
+        finals = {intern(final_state, state2id)}
+        return cls.from_arcs(len(state2id), symbols, initial, finals, arc_list)
+
+    def arcs(self, state):
+        for arc in range(self.arc_offsets[state], self.arc_offsets[state+1]):
+            yield self.arc_labels[arc], self.arc_next[arc]
+
+    def step(self, state, label):
+        #the next state of a deterministic FSA, or -1
+        start, end = self.arc_offsets[state], self.arc_offsets[state+1]
+        arc = bisect_left(self.arc_labels, label, start, end)
+        return self.arc_next[arc] if arc < end and self.arc_labels[arc] == label else -1
+
+    def accepts(self, symbols):
+        '''
+        One walk through a deterministic FSA (see determinize).
+        :param symbols: sequence of symbols, e.g. the characters of a word
+        '''
+        state = self.initial
+        for symbol in symbols:
+            label = self.symbol2id.get(symbol, -1)
+            if label < 0:
+                return False
+            state = self.step(state, label)
+            if state < 0:
+                return False
+        return state in self.finals
+
+    def write_carmel(self, output_file):
+        '''
+        Carmel files have one final state, so if there are several, each gets an *e* arc to an extra final state F.
+        '''
+        finals = sorted(self.finals)
+        lines = [str(finals[0]) if len(finals) == 1 else 'F']
+        order = [self.initial] + [state for state in range(self.num_states) if state != self.initial]
+        for state in order: #the initial state has to come first
+            for label, next_state in self.arcs(state):
+                symbol = self.symbols[label].replace('\\', '\\\\').replace('"', '\\"')
+                lines.append('({} ({} "{}"))'.format(state, next_state, symbol))
+        if len(finals) > 1:
+            lines.extend('({} (F *e*))'.format(state) for state in finals)
+        with open(output_file, 'w') as outfile:
+            outfile.write('\n'.join(lines) + '\n')
+
+
+def epsilon_closure(fsa, states, epsilon):
+    closure, stack = set(states), list(states)
+    while stack:
+        state = stack.pop()
+        for label, next_state in fsa.arcs(state):
+            if label == epsilon and next_state not in closure:
+                closure.add(next_state)
+                stack.append(next_state)
+    return frozenset(closure)
+
+
+def nfa_accepts(fsa, symbols):
+    #acceptance without determinizing, by tracking the set of states (what carmel does)
+    epsilon = fsa.symbol2id.get(EPSILON, -1)
+    states = epsilon_closure(fsa, [fsa.initial], epsilon)
+    for symbol in symbols:
+        label = fsa.symbol2id.get(symbol, -1)
+        states = epsilon_closure(fsa, [next_state for state in states for arc_label, next_state in fsa.arcs(state)
+                                       if arc_label == label], epsilon)
+        if not states:
+            return False
+    return bool(states & fsa.finals)
+
+
+def determinize(fsa):
+    '''
+    Subset construction: each state of the result is the epsilon closure of a set of states of fsa. Only the subsets
+    reachable from the initial state are built.
+    :return: a deterministic FSA without *e* arcs (same symbol ids as fsa)
+    '''
+    epsilon = fsa.symbol2id.get(EPSILON, -1)
+    start = epsilon_closure(fsa, [fsa.initial], epsilon)
+    subset_ids = {start: 0}
+    queue = deque([start])
+    arcs, finals = [], set()
+    while queue:
+        subset = queue.popleft()
+        subset_id = subset_ids[subset]
+        if subset & fsa.finals:
+            finals.add(subset_id)
+        moves = {}
+        for state in subset:
+            for label, next_state in fsa.arcs(state):
+                if label != epsilon:
+                    moves.setdefault(label, set()).add(next_state)
+        for label in sorted(moves):
+            next_subset = epsilon_closure(fsa, moves[label], epsilon)
+            if next_subset not in subset_ids:
+                subset_ids[next_subset] = len(subset_ids)
+                queue.append(next_subset)
+            arcs.append((subset_id, label, subset_ids[next_subset]))
+    return FSA.from_arcs(len(subset_ids), fsa.symbols, 0, finals, arcs)
+
+
+def minimize(dfa):
+    '''
+    Hopcroft's algorithm on a deterministic FSA. Missing arcs go to an implicit dead state, which is dropped again at
+    the end along with every state equivalent to it (states that can't reach a final state).
+    :return: the minimal deterministic FSA
+    '''
+    dead = dfa.num_states
+    labels = sorted(set(dfa.arc_labels))
+    #inverse[label][state] = states with an arc on label to state. The dead state gets every missing arc
+    inverse = {label: [[] for _ in range(dfa.num_states+1)] for label in labels}
+    for state in range(dfa.num_states):
+        present = set()
+        for label, next_state in dfa.arcs(state):
+            inverse[label][next_state].append(state)
+            present.add(label)
+        for label in labels:
+            if label not in present:
+                inverse[label][dead].append(state)
+    for label in labels:
+        inverse[label][dead].append(dead)
+
+    finals = set(dfa.finals)
+    non_finals = set(range(dfa.num_states+1)) - finals
+    blocks = [block for block in (finals, non_finals) if block]
+    block_of = [0]*(dfa.num_states+1)
+    for block_id, block in enumerate(blocks):
+        for state in block:
+            block_of[state] = block_id
+    #only the smaller of the first two blocks needs to be a splitter
+    waiting = {min(range(len(blocks)), key=lambda block_id: len(blocks[block_id]))}
+    while waiting:
+        splitter = list(blocks[waiting.pop()])
+        for label in labels:
+            #the states with an arc on label into the splitter, grouped by block
+            sources = {}
+            for state in splitter:
+                for source in inverse[label][state]:
+                    sources.setdefault(block_of[source], set()).add(source)
+            for block_id, inside in sources.items():
+                block = blocks[block_id]
+                if len(inside) == len(block):
+                    continue
+                outside = block - inside
+                #the smaller part becomes the new block
+                new_part, old_part = (inside, outside) if len(inside) <= len(outside) else (outside, inside)
+                blocks[block_id] = old_part
+                new_id = len(blocks)
+                blocks.append(new_part)
+                for state in new_part:
+                    block_of[state] = new_id
+                if block_id in waiting:
+                    waiting.add(new_id)
+                else:
+                    waiting.add(new_id if len(new_part) <= len(old_part) else block_id)
+
+    #renumber the blocks (without the dead block) in the order they are reached from the initial state
+    dead_block = block_of[dead]
+    new_ids = {block_of[dfa.initial]: 0}
+    queue = deque([dfa.initial])
+    arcs = []
+    while queue:
+        state = queue.popleft() #a representative of its block
+        for label, next_state in dfa.arcs(state):
+            next_block = block_of[next_state]
+            if next_block == dead_block:
+                continue
+            if next_block not in new_ids:
+                new_ids[next_block] = len(new_ids)
+                queue.append(next_state)
+            arcs.append((new_ids[block_of[state]], label, new_ids[next_block]))
+    new_finals = {new_ids[block_of[state]] for state in dfa.finals if block_of[state] in new_ids}
+    if block_of[dfa.initial] == dead_block: #accepts nothing
+        return FSA.from_arcs(1, dfa.symbols, 0, set(), [])
+    return FSA.from_arcs(len(new_ids), dfa.symbols, 0, new_finals, arcs)
+
+
+if __name__ == "__main__":
+    fsa = FSA.from_file(sys.argv[1])
+    dfa = determinize(fsa)
+    min_dfa = minimize(dfa)
+    print('expanded: {}\ndeterminized: {}\nminimized: {}'.format(fsa, dfa, min_dfa), file=sys.stderr)
+    min_dfa.write_carmel(sys.argv[2])
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], 'r') as infile:
+            for line in infile:
+                if line.strip():
+                    print('{} => {}'.format(line.strip(), 'yes' if min_dfa.accepts(line.strip()) else 'no'))
@@ -0,0 +1,69 @@
+'''
+State and arc counts of the expanded FSA (expand_fsm1.py) before and after determinize and minimize (fsa_ops.py), on
+the lexicon scaled up with made up words.
+
+Command to run: fsa_report.py lexicon morph_rules [--scales 1 10 100 1000] [--check N] [--fsa-file FILE]
+
+For scale k, k made up words per lexicon entry are added with the entry's class. They are made from the characters of
+the lexicon, with the same lengths, so they share prefixes like real words do. --check N words (lexicon words, made up
+words and their concatenations) are checked to be accepted the same way by the expanded FSA and the minimal DFA.
+The expanded FSA is written to --fsa-file if given (and kept, for the last scale), otherwise to a temporary directory
+that is removed afterwards.
+'''
+
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from expand_fsm1 import expand_fsm, import_lexicon, import_morphotactics
+from fsa_ops import FSA, determinize, minimize, nfa_accepts
+
+
+def scale_lexicon(lexicon, scale, seed=0):
+    rng = random.Random(seed)
+    chars = sorted(set(''.join(word for word, class_label in lexicon)))
+    scaled = list(lexicon)
+    for word, class_label in lexicon:
+        for _ in range(scale-1):
+            scaled.append((''.join(rng.choice(chars) for _ in word), class_label))
+    return scaled
+
+
+def report(lexicon, morph_rules, scale, num_checks, fsa_file):
+    #prints the report line for one scale, writing the expanded FSA to fsa_file
+    scaled = scale_lexicon(lexicon, scale)
+    with open(fsa_file, 'w') as outfile:
+        outfile.write('\n'.join(expand_fsm(morph_rules, scaled)))
+    fsa = FSA.from_file(fsa_file)
+    start = time.perf_counter()
+    dfa = determinize(fsa)
+    determinize_time = time.perf_counter() - start
+    start = time.perf_counter()
+    min_dfa = minimize(dfa)
+    minimize_time = time.perf_counter() - start
+    rng = random.Random(scale)
+    words = [word for word, class_label in scaled]
+    checks = [rng.choice(words) + rng.choice(['', rng.choice(words)]) for _ in range(num_checks)]
+    agree = sum(1 for word in checks if nfa_accepts(fsa, word) == min_dfa.accepts(word))
+    print('{}\t{}/{}\t{}/{}\t{}/{}\t{:.2f}\t{:.2f}\t{}/{} agree'.format(
+        len(scaled), fsa.num_states, len(fsa.arc_next), dfa.num_states, len(dfa.arc_next), min_dfa.num_states,
+        len(min_dfa.arc_next), determinize_time, minimize_time, agree, len(checks)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Expanded FSA size before and after determinization/minimization')
+    parser.add_argument('lexicon')
+    parser.add_argument('morph_rules')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--check', type=int, default=2000, help='number of words to check acceptance on')
+    parser.add_argument('--fsa-file', help='where to write the expanded FSA (a temporary file if not given)')
+    args = parser.parse_args()
+
+    lexicon, morph_rules = import_lexicon(args.lexicon), import_morphotactics(args.morph_rules)
+    print('words\texpanded states/arcs\tdeterminized\tminimized\tdeterminize s\tminimize s\tchecked')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fsa_file = args.fsa_file or os.path.join(temp_dir, 'fsa_report.fsa')
+        for scale in args.scales:
+            report(lexicon, morph_rules, scale, args.check, fsa_file)
@@ -1,38 +1,30 @@
 #checks whether input words are accepted by the given expanded FSM (of type created in Q1)
-#command morph_acceptor.py fsm word_list
+#command morph_acceptor.py fsm word_list output_file
 '''
 wordlist is a list of words, one per line
 output file has format "input word => answer" with "no" or "yes"
 
-
+This used to run "echo w o r d | carmel fsm -sli" once per word and parse carmel's output, i.e. a process start per
+word (and carmel had to be installed). Now the FSM is read once with fsa_ops.FSA, determinized (fsa_ops.determinize),
+and each word is one deterministic walk, one arc lookup per character. The answers are the same as carmel's.
+As before, a word that is in the list more than once is only written once, where it first appears.
 '''
-import subprocess
 import sys
-import re
+
+from fsa_ops import FSA, determinize
+
+
+def read_words(input_file):
+    #the distinct words of the word list, in order
+    with open(input_file, 'r') as file:
+        return list(dict.fromkeys(line.strip() for line in file if line.strip()))
+
 
 if __name__ == "__main__":
     fsm = sys.argv[1]
     input_file = sys.argv[2]
     output_file = sys.argv[3]
-    line_dict = {}
-    with open(input_file,'rU') as file:
-        for line in file:
-            if line:
-                new_line = re.sub(r'(.)', r'\1 ', line).strip()
-                line_dict[line.strip()] = new_line
-    with open(output_file,'w') as output_file:
-        for item in line_dict.items():
-            #print('Input {} Modified Input {}'.format(item[0],item[1]))
-            output = subprocess.check_output('echo {}|carmel {} -sli'.format(item[1], fsm),shell=True, universal_newlines=True,stderr=subprocess.STDOUT).split('\n')
-            input = item[0]
-            current_index = 0
-            for line in output:
-                input_string=re.search('(?<=Input line \d:).*', line)
-                if input_string:
-                    next_line = output[current_index+1]
-                    if '(0 states / 0 arcs)' in next_line:
-                        result = 'no'
-                    else:
-                        result = 'yes'
-                    output_file.write(input+' => '+result+'\n')
-                current_index+=1
\ No newline at end of file
+    dfa = determinize(FSA.from_file(fsm))
+    with open(output_file, 'w') as output_file:
+        for word in read_words(input_file):
+            output_file.write(word+' => '+('yes' if dfa.accepts(word) else 'no')+'\n')
@@ -1,41 +1,40 @@
-#checks whether input words are accepted by the given expanded FSM (of type created in Q1)
-#command morph_acceptor.py fsm word_list
+#checks whether input words are accepted by the given expanded FST (of type created in Q2) and gives their morphemes
+#command morph_acceptor.py fst word_list output_file
 '''
 wordlist is a list of words, one per line
-output file has format "input word => answer" where answer is either morph1/label1 morph2/label2 or *NON*
-
+output file has format "input word => answer" where answer is either morph1/label1 morph2/label2 or *NONE*
 
+This used to run "echo w o r d | carmel fst -slibOE" once per word and parse carmel's output. Now the FST is read once
+into a compiled_fst.CompiledFST (finite_state_transducers), and every word is decoded with the same BatchDecoder, which
+finds the best path like carmel -b. Its outputs (without *e*) are joined and each "|" that ends a morpheme becomes a
+space, as before.
+As in morph_acceptor1.py, a word that is in the list more than once is only written once.
 '''
-import subprocess
+import os
 import sys
-import re
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'finite_state_transducers'))
+from compiled_fst import CompiledFST, BatchDecoder
+from fst_acceptor2 import EPSILON
+from morph_acceptor1 import read_words
+
+
+def segment(decoder, word):
+    '''
+    :param decoder: a BatchDecoder of an expand_fsm2.py FST
+    :return: the morph/label segmentation of word, or *NONE* if the FST doesn't accept it
+    '''
+    outputs, prob = decoder.decode(list(word))
+    if outputs is None:
+        return '*NONE*'
+    return ''.join(output for output in outputs if output != EPSILON).replace('|', ' ').strip()
+
 
 if __name__ == "__main__":
     fsm = sys.argv[1]
     input_file = sys.argv[2]
     output_file = sys.argv[3]
-    line_dict = {} #consider not using a dict since then it won't be ordered...
-    with open(input_file,'rU') as file:
-        for line in file:
-            if line:
-                new_line = re.sub(r'(.)', r'\1 ', line).strip()
-                line_dict[line.strip()] = new_line
+    decoder = BatchDecoder(CompiledFST.from_file(fsm))
     with open(output_file, 'w') as output_file:
-        for item in line_dict.items():
-            #print('Input {} Modified Input {}'.format(item[0],item[1]))
-            output = subprocess.check_output('echo {}|carmel {} -slibOE'.format(item[1], fsm),shell=True, universal_newlines=True,stderr=subprocess.STDOUT).split('\n')
-            input = item[0]
-            current_index = 0
-            for line in output:
-                #print(line)
-                input_string=re.search('(?<=Input line \d:).*', line)
-                if input_string:
-                    next_line = output[current_index+1]
-                    if '(0 states / 0 arcs)' in next_line:
-                        result = '*NONE*'
-                    else:
-                        output_line = output[current_index+2]
-                        result =''.join(output_line.split()[:-1])
-                        result = re.sub(r'[|]',r' ',result).strip()
-                    output_file.write(input+' => '+result+'\n')
-                current_index+=1
+        for word in read_words(input_file):
+            output_file.write(word+' => '+segment(decoder, word)+'\n')
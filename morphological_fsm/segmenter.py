@@ -0,0 +1,134 @@
+'''
+Morphological segmentation of running text with a memoized analysis per surface form.
+
+morph_acceptor2.py analyses each distinct word of a word list once and writes one line per distinct word. In running
+text the same forms repeat over and over (a few thousand types cover most tokens), so here every token gets its line,
+in input order, but a form is only decoded the first time it is seen: the analyses are kept in an LRU cache keyed by the
+surface form. The cache can be saved to a file and loaded by the next run, so analysing more of a corpus only costs the
+forms that are new. The cache file records the sha256 of the FST it was made with and is ignored if the FST changed.
+
+Command to run: segmenter.py fst input_file output_file [--cache-size N] [--cache-file FILE]
+fst: an expanded FST from expand_fsm2.py (or a .cfst, see compiled_fst.py)
+input_file: text, any number of whitespace separated words per line
+output_file: one line per word, "word => morph1/label1 morph2/label2" or "word => *NONE*" as in morph_acceptor2.py
+Prints the number of words, the number decoded and the cache hit rate.
+'''
+
+import os
+import sys
+import pickle
+import hashlib
+import argparse
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'finite_state_transducers'))
+from compiled_fst import CompiledFST, BatchDecoder
+from morph_acceptor2 import segment
+
+CACHE_VERSION = 1
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+def file_digest(input_file):
+    sha = hashlib.sha256()
+    with open(input_file, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Segmenter:
+    def __init__(self, fst_file, cache_size=100000):
+        '''
+        :param fst_file: an expand_fsm2.py FST (carmel or .cfst)
+        :param cache_size: number of analyses kept in the LRU cache (0 turns it off)
+        '''
+        self.decoder = BatchDecoder(CompiledFST.from_file(fst_file))
+        self.fst_digest = file_digest(fst_file)
+        self.cache = LRUCache(cache_size)
+
+    def analyse(self, word):
+        analysis = self.cache.get(word)
+        if analysis is None:
+            analysis = segment(self.decoder, word)
+            self.cache.put(word, analysis)
+        return analysis
+
+    def analyse_lines(self, lines):
+        '''
+        :param lines: iterable of lines of text
+        :return: generator of (word, analysis), one per word, in input order (repeats included)
+        '''
+        for line in lines:
+            for word in line.split():
+                yield word, self.analyse(word)
+
+    def load_cache(self, cache_file):
+        #:return: whether the cache file was for this FST (and so was loaded)
+        with open(cache_file, 'rb') as infile:
+            version, fst_digest, items = pickle.load(infile)
+        if version != CACHE_VERSION or fst_digest != self.fst_digest:
+            return False
+        for word, analysis in items: #least recently used first, so the order survives the round trip
+            self.cache.put(word, analysis)
+        return True
+
+    def save_cache(self, cache_file):
+        #write then rename, so a run that is killed half way doesn't leave a broken cache
+        temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temp_file, 'wb') as outfile:
+            pickle.dump((CACHE_VERSION, self.fst_digest, list(self.cache.entries.items())), outfile,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Segments every word of a text with an expanded morphology FST')
+    parser.add_argument('fst')
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    parser.add_argument('--cache-size', type=int, default=100000, help='number of analyses kept (0 for no cache)')
+    parser.add_argument('--cache-file', help='load the cache from this file if it exists, and save it there after')
+    args = parser.parse_args()
+
+    segmenter = Segmenter(args.fst, args.cache_size)
+    if args.cache_file and os.path.exists(args.cache_file):
+        if segmenter.load_cache(args.cache_file):
+            print('Loaded {} analyses from {}'.format(len(segmenter.cache.entries), args.cache_file), file=sys.stderr)
+        else:
+            print('{} was made with a different FST, starting with an empty cache'.format(args.cache_file),
+                  file=sys.stderr)
+    with open(args.input_file, 'r') as infile, open(args.output_file, 'w') as outfile:
+        for word, analysis in segmenter.analyse_lines(infile):
+            outfile.write(word+' => '+analysis+'\n')
+    if args.cache_file:
+        segmenter.save_cache(args.cache_file)
+    stats = segmenter.cache.stats()
+    total = stats['hits'] + stats['misses']
+    print('{} words, {} decoded, cache hit rate {:.1%}'.format(total, stats['misses'],
+                                                              stats['hits']/total if total else 0), file=sys.stderr)
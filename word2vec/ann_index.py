@@ -0,0 +1,200 @@
+'''
+An approximate nearest neighbour index for word vectors (an inverted file index, IVF).
+
+cosine_sim and euclidean_dist in word_analogy.py scan the whole vocabulary for every query, which is fine for 70k words
+but not for multi million word tables or interactive use. Here the vectors are clustered with k-means (the coarse
+quantizer) and each vector is put in the list of its nearest centroid. A query only scans the lists of its nprobe
+nearest centroids, so it looks at roughly nprobe/num_lists of the vocabulary. More probes is slower but finds the exact
+answer more often.
+
+Command to run: ann_index.py vector_file index_file num_lists normalise similarity [--queries N] [--nprobe 1 4 16]
+[--question-dir DIR]
+
+Builds an index over the vectors, saves it to index_file (.npz), then measures recall@1 (how often the approximate
+best match is the exact best match from word_analogy.solve_analogies) and query time for each nprobe.
+Queries are the analogy targets x_b - x_a + x_c from the files in --question-dir if given, otherwise vocabulary vectors
+with gaussian noise added.
+'''
+
+import sys
+import os
+import time
+import argparse
+
+import numpy as np
+
+from vector_io import load_vectors
+from word_analogy import read_analogies, query_matrix, solve_analogies, row_norms
+
+
+class IVFIndex:
+    def __init__(self, vec_array, sim, centroids=None, list_offsets=None, list_members=None):
+        '''
+        :param vec_array: the vectors being indexed (not copied, so a memory mapped array stays memory mapped)
+        :param sim: a flag that if 0 uses Euclidean distance, if >0 uses cosine
+        centroids, list_offsets, list_members are set by build (or load). List i holds the vector indices
+        list_members[list_offsets[i]:list_offsets[i+1]]
+        '''
+        self.vec_array = vec_array
+        self.sim = sim
+        self.vec_norms = row_norms(vec_array)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_members = list_members
+
+    def __str__(self):
+        return 'An IVF index of {} vectors in {} lists'.format(self.vec_array.shape[0], len(self.centroids))
+
+    def centroid_scores(self, queries):
+        #higher is closer, for either metric
+        if self.sim:
+            return np.dot(queries, self.centroids.T)
+        return 2*np.dot(queries, self.centroids.T) - (self.centroids**2).sum(axis=1)[None, :]
+
+    def build(self, num_lists, iterations=10, sample_size=None, seed=0):
+        '''
+        k-means over a sample of the vectors, then every vector goes into the list of its nearest centroid.
+        For cosine the vectors and centroids are normalised (spherical k-means).
+        '''
+        rng = np.random.default_rng(seed)
+        num_vecs = self.vec_array.shape[0]
+        num_lists = min(num_lists, num_vecs)
+        sample_size = min(num_vecs, sample_size or 64*num_lists)
+        sample = np.asarray(self.vec_array[np.sort(rng.choice(num_vecs, sample_size, replace=False))], dtype=np.float64)
+        if self.sim:
+            sample = self.unit(sample)
+        self.centroids = sample[rng.choice(sample_size, num_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self.nearest_lists(sample, 1)[:, 0]
+            counts = np.bincount(assignment, minlength=num_lists)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignment, sample)
+            empty = counts == 0
+            #restart empty clusters from random points
+            sums[empty] = sample[rng.choice(sample_size, empty.sum())]
+            counts[empty] = 1
+            self.centroids = sums / counts[:, None]
+            if self.sim:
+                self.centroids = self.unit(self.centroids)
+        assignment = self.nearest_lists(self.vec_array, 1)[:, 0]
+        self.list_members = np.argsort(assignment, kind='stable').astype(np.int64)
+        self.list_offsets = np.zeros(num_lists+1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=num_lists), out=self.list_offsets[1:])
+        return self
+
+    @staticmethod
+    def unit(vectors):
+        norms = row_norms(vectors)
+        norms[norms == 0] = 1
+        return vectors / norms[:, None]
+
+    def nearest_lists(self, vectors, nprobe, chunk_size=4096):
+        #the nprobe best centroids of each vector, in chunks to keep the score matrix small
+        nprobe = min(nprobe, len(self.centroids))
+        best = np.zeros((vectors.shape[0], nprobe), dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk_size):
+            scores = self.centroid_scores(np.asarray(vectors[start:start+chunk_size], dtype=np.float64))
+            top = np.argpartition(-scores, nprobe-1, axis=1)[:, :nprobe]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+            best[start:start+chunk_size] = np.take_along_axis(top, order, axis=1)
+        return best
+
+    def query(self, queries, k=1, nprobe=8):
+        '''
+        Queries are handled list by list rather than one at a time: all the queries that probe a list are scored
+        against it with one matrix multiply, and the running top k of each query is merged with the list's top k.
+        :param queries: 2D numpy array, one query vector per row
+        :return: 2D numpy array (queries x k) of vector indices, best first. -1 where fewer than k were scanned
+        '''
+        queries = np.asarray(queries, dtype=np.float64)
+        probes = self.nearest_lists(queries, nprobe)
+        best_scores = np.full((queries.shape[0], k), -np.inf)
+        best_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        #(query, list) pairs grouped by list
+        pair_rows = np.repeat(np.arange(queries.shape[0]), probes.shape[1])
+        pair_lists = probes.ravel()
+        order = np.argsort(pair_lists, kind='stable')
+        pair_rows, pair_lists = pair_rows[order], pair_lists[order]
+        group_starts = np.flatnonzero(np.r_[True, pair_lists[1:] != pair_lists[:-1]])
+        for group_start, group_end in zip(group_starts, np.r_[group_starts[1:], len(pair_lists)]):
+            lst = pair_lists[group_start]
+            members = self.list_members[self.list_offsets[lst]:self.list_offsets[lst+1]]
+            if members.size == 0:
+                continue
+            rows = pair_rows[group_start:group_end]
+            dots = np.dot(queries[rows], np.asarray(self.vec_array[members], dtype=np.float64).T)
+            if self.sim:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    scores = dots / self.vec_norms[members][None, :]
+            else:
+                scores = 2*dots - (self.vec_norms[members]**2)[None, :]
+            scores = np.nan_to_num(scores, nan=-np.inf)
+            #merge with the running top k
+            all_scores = np.hstack([best_scores[rows], scores])
+            all_ids = np.hstack([best_ids[rows], np.broadcast_to(members, scores.shape)])
+            top = np.argpartition(-all_scores, k-1, axis=1)[:, :k]
+            best_scores[rows] = np.take_along_axis(all_scores, top, axis=1)
+            best_ids[rows] = np.take_along_axis(all_ids, top, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best_ids, order, axis=1)
+
+    def save(self, filename):
+        np.savez(filename, sim=self.sim, centroids=self.centroids, list_offsets=self.list_offsets,
+                 list_members=self.list_members)
+
+    @classmethod
+    def load(cls, filename, vec_array):
+        #the vectors aren't saved in the index, so they have to be the ones the index was built on
+        with np.load(filename) as index_data:
+            if index_data['list_members'].size != vec_array.shape[0]:
+                sys.exit('Index {} was built on {} vectors, not {}'.format(
+                    filename, index_data['list_members'].size, vec_array.shape[0]))
+            return cls(vec_array, int(index_data['sim']), index_data['centroids'], index_data['list_offsets'],
+                       index_data['list_members'])
+
+
+def recall_at_1(index, queries, nprobe, max_bytes=2**29):
+    '''
+    :return: fraction of queries where the approximate best match is the exact best match, exact and approximate
+    query times in seconds
+    '''
+    start = time.perf_counter()
+    exact = solve_analogies(queries, index.vec_array, index.vec_norms, index.sim, max_bytes)
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    approx = index.query(queries, 1, nprobe)[:, 0]
+    approx_time = time.perf_counter() - start
+    return (exact == approx).mean(), exact_time, approx_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Builds an IVF index over word vectors and measures its recall@1')
+    parser.add_argument('vector_file')
+    parser.add_argument('index_file')
+    parser.add_argument('num_lists', type=int)
+    parser.add_argument('normalise', type=int, help='if non-zero, normalise word embedding vectors first')
+    parser.add_argument('similarity', type=int, help='if non-zero, use cosine. else use Euclidean')
+    parser.add_argument('--queries', type=int, default=1000, help='number of noisy vocabulary queries')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--question-dir', help='use the analogies in this directory as queries')
+    args = parser.parse_args()
+
+    word2index, index2word, vec_array, vec_length = load_vectors(args.vector_file, args.normalise)
+    start = time.perf_counter()
+    index = IVFIndex(vec_array, args.similarity).build(args.num_lists)
+    print('Built index with {} lists in {:.2f}s'.format(args.num_lists, time.perf_counter()-start))
+    index.save(args.index_file)
+    index = IVFIndex.load(args.index_file, vec_array)
+
+    if args.question_dir:
+        analogies = [analogy for filename in sorted(os.listdir(args.question_dir))
+                     for analogy in read_analogies(os.path.join(args.question_dir, filename))]
+        queries = query_matrix(analogies, word2index, vec_array)
+    else:
+        rng = np.random.default_rng(0)
+        queries = np.asarray(vec_array[rng.choice(vec_array.shape[0], args.queries)], dtype=np.float64)
+        queries += rng.normal(scale=queries.std(), size=queries.shape)
+    for nprobe in args.nprobe:
+        recall, exact_time, approx_time = recall_at_1(index, queries, nprobe)
+        print('nprobe {}: recall@1 {:.3f}, exact scan {:.2f}s, index {:.2f}s'.format(
+            nprobe, recall, exact_time, approx_time))
@@ -0,0 +1,45 @@
+'''
+Compares storing the embedding matrix as float64, float32, float16 and int8 (see quantize.py) on the analogy
+question sets: memory, time to solve every analogy, and accuracy change against float64.
+
+Command to run: quant_report.py vector_file input_dir normalise similarity
+
+input_dir: a directory of analogy files, e.g. examples/question-data
+'''
+
+import sys
+import os
+import time
+
+import numpy as np
+
+from vector_io import load_vectors
+from quantize import QuantizedVectors, DTYPES
+from word_analogy import read_analogies, query_matrix, solve_analogies, row_norms
+
+
+if __name__ == "__main__":
+    vector_file, input_dir = sys.argv[1], sys.argv[2]
+    norm, sim = int(sys.argv[3]), int(sys.argv[4])
+
+    word2index, index2word, vec_array, vec_length = load_vectors(vector_file, norm)
+    vec_array = np.asarray(vec_array, dtype=np.float64)
+    analogies = [analogy for filename in sorted(os.listdir(input_dir))
+                 for analogy in read_analogies(os.path.join(input_dir, filename))]
+    #the queries are always built from the float64 vectors, so only the scoring changes
+    queries = query_matrix(analogies, word2index, vec_array)
+    gold = np.array([word2index.get(analogy[3], -1) for analogy in analogies])
+
+    baseline_winners, baseline_time = None, None
+    print('{:8} {:>10} {:>9} {:>8} {:>10} {:>12}'.format('dtype', 'MB', 'seconds', 'speedup', 'accuracy',
+                                                         'same as f64'))
+    for dtype in DTYPES:
+        vectors = vec_array if dtype == 'float64' else QuantizedVectors(vec_array, dtype)
+        start = time.perf_counter()
+        winners = solve_analogies(queries, vectors, row_norms(vectors), sim, 2**29)
+        seconds = time.perf_counter() - start
+        if baseline_winners is None:
+            baseline_winners, baseline_time = winners, seconds
+        print('{:8} {:10.1f} {:9.2f} {:8.2f} {:9.2f}% {:11.2f}%'.format(
+            dtype, vectors.nbytes/2**20, seconds, baseline_time/seconds, 100*(winners == gold).mean(),
+            100*(winners == baseline_winners).mean()))
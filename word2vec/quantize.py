@@ -0,0 +1,91 @@
+'''
+Smaller storage for the embedding matrix: float32, float16 or int8 with a scale per row.
+
+read_vectors keeps everything as float64. That is twice the memory of a float32 model, and every similarity pass reads
+the whole matrix, so it is memory bandwidth bound. QuantizedVectors keeps the matrix in a smaller type and scores
+queries against it a block of rows at a time: the block is widened to float32 just for the matrix multiply, and for int8
+the row scales are applied to the (queries x block) result rather than to the matrix.
+
+int8: each row is divided by max(|row|)/127 and rounded, so row = scale * int8 row (to within half a step).
+'''
+
+import numpy as np
+
+DTYPES = ['float64', 'float32', 'float16', 'int8']
+
+
+class QuantizedVectors:
+    def __init__(self, vec_array, dtype, block_rows=65536):
+        '''
+        :param vec_array: 2D numpy array of vectors
+        :param dtype: one of DTYPES
+        :param block_rows: number of rows widened to float32 at a time when scoring
+        '''
+        if dtype not in DTYPES:
+            raise ValueError('dtype must be one of {}, not {}'.format(DTYPES, dtype))
+        self.dtype = dtype
+        self.block_rows = block_rows
+        vec_array = np.asarray(vec_array)
+        if dtype == 'int8':
+            scales = np.abs(vec_array).max(axis=1) / 127
+            scales[scales == 0] = 1 #zero vectors stay zero
+            self.data = np.rint(vec_array / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        else:
+            self.data = vec_array.astype(dtype)
+            self.scales = None
+        #the norms of the stored (not original) vectors, so cosine scores are consistent with the dot products
+        self.norms = np.zeros(self.shape[0])
+        for start in range(0, self.shape[0], block_rows):
+            self.norms[start:start+block_rows] = (self.rows(start, start+block_rows)**2).sum(axis=1)**.5
+
+    @classmethod
+    def from_arrays(cls, dtype, data, scales, norms, block_rows=65536):
+        #wraps already quantized arrays (e.g. in shared memory) without copying them
+        vectors = cls.__new__(cls)
+        vectors.dtype, vectors.block_rows = dtype, block_rows
+        vectors.data, vectors.scales, vectors.norms = data, scales, norms
+        return vectors
+
+    def __str__(self):
+        return 'QuantizedVectors {} x {} as {} ({:.1f} MB)'.format(self.shape[0], self.shape[1], self.dtype,
+                                                                  self.nbytes/2**20)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def rows(self, start, end):
+        #dequantized rows start:end, as float32 (float64 if stored as float64)
+        block = self.data[start:end]
+        block = block if self.dtype == 'float64' else block.astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:end, None]
+        return block
+
+    def __getitem__(self, indices):
+        #dequantized rows, like indexing a numpy array of the vectors
+        rows = self.data[indices].astype(np.float64)
+        if self.scales is not None:
+            rows *= self.scales[indices][..., None]
+        return rows
+
+    def scores(self, queries):
+        '''
+        :param queries: 2D numpy array, one query vector per row
+        :return: 2D numpy array (queries x vocab) of dot products with the stored vectors
+        '''
+        if self.dtype in ('float64', 'float32'):
+            return np.dot(queries.astype(self.data.dtype), self.data.T)
+        queries = queries.astype(np.float32)
+        result = np.empty((queries.shape[0], self.shape[0]), dtype=np.float32)
+        for start in range(0, self.shape[0], self.block_rows):
+            block = self.data[start:start+self.block_rows].astype(np.float32)
+            result[:, start:start+self.block_rows] = np.dot(queries, block.T)
+            if self.scales is not None:
+                result[:, start:start+self.block_rows] *= self.scales[start:start+self.block_rows]
+        return result
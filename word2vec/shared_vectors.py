@@ -0,0 +1,63 @@
+'''
+Puts the (normalised) embedding matrix in shared memory so that a pool of evaluator processes can all use one copy,
+instead of each loading (or being sent) its own.
+
+share_vectors is called once in the parent. attach_vectors is called in each worker with the small, picklable spec it
+returns, and gives back numpy arrays backed by the shared block (no copy).
+'''
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from quantize import QuantizedVectors
+from word_analogy import row_norms
+
+
+def share_array(array):
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def share_vectors(vec_array):
+    '''
+    :param vec_array: numpy array (or memory mapped array) of vectors, or a QuantizedVectors
+    :return: list of SharedMemory blocks (the caller has to close and unlink them when the workers are done),
+    spec to pass to attach_vectors
+    '''
+    if isinstance(vec_array, QuantizedVectors):
+        arrays = {'data': vec_array.data, 'norms': vec_array.norms}
+        if vec_array.scales is not None:
+            arrays['scales'] = vec_array.scales
+        kind = vec_array.dtype
+    else:
+        arrays = {'data': np.asarray(vec_array), 'norms': row_norms(vec_array)}
+        kind = None
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        block, specs[name] = share_array(array)
+        blocks.append(block)
+    return blocks, (kind, specs)
+
+
+def attach_vectors(spec):
+    '''
+    :param spec: as returned by share_vectors
+    :return: list of SharedMemory blocks (keep them referenced while the arrays are used), vectors, vector norms
+    '''
+    kind, specs = spec
+    blocks, arrays = [], {}
+    for name, array_spec in specs.items():
+        block, arrays[name] = attach_array(array_spec)
+        blocks.append(block)
+    if kind is None:
+        return blocks, arrays['data'], arrays['norms']
+    vectors = QuantizedVectors.from_arrays(kind, arrays['data'], arrays.get('scales'), arrays['norms'])
+    return blocks, vectors, vectors.norms
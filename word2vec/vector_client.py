@@ -0,0 +1,69 @@
+'''
+Client for vector_service.py.
+
+Command to run: vector_client.py input_dir output_dir [--port PORT] [--top-k K] [--no-exclude]
+
+Sends each analogy file in input_dir to the service as one /analogy batch, writes the answers to output_dir in the
+word_analogy.py output format and prints the accuracies. Running it twice shows the effect of the result cache.
+'''
+
+import os
+import json
+import time
+import argparse
+from urllib import request as urlrequest
+
+from word_analogy import read_analogies
+
+
+class VectorClient:
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.url = 'http://{}:{}'.format(host, port)
+
+    def call(self, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urlrequest.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        with urlrequest.urlopen(req) as response:
+            return json.loads(response.read())
+
+    def neighbours(self, words, k=10):
+        return self.call('/neighbours', {'words': list(words), 'k': k})['results']
+
+    def analogy(self, analogies, k=1, exclude=True):
+        return self.call('/analogy', {'analogies': [list(analogy[:3]) for analogy in analogies], 'k': k,
+                                      'exclude': exclude})['results']
+
+    def similarity(self, pairs):
+        return self.call('/similarity', {'pairs': [list(pair) for pair in pairs]})['results']
+
+    def stats(self):
+        return self.call('/stats')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Analogy evaluation through vector_service.py')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--top-k', type=int, default=1)
+    parser.add_argument('--no-exclude', action='store_true', help='allow A, B or C as the answer')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    client = VectorClient(port=args.port)
+    start = time.perf_counter()
+    sum_total, sum_total_corr = 0, 0
+    for filename in sorted(os.listdir(args.input_dir)):
+        analogies = read_analogies(os.path.join(args.input_dir, filename))
+        results = client.analogy(analogies, args.top_k, not args.no_exclude)
+        total_corr = sum(1 for analogy, ranked in zip(analogies, results) if ranked[0][0] == analogy[3])
+        with open(os.path.join(args.output_dir, filename), 'w') as outfile:
+            outfile.write('\n'.join('{} {} {} {}'.format(*analogy[:3], ' '.join(word for word, score in ranked))
+                                    for analogy, ranked in zip(analogies, results)))
+        print('{}:'.format(filename))
+        print('ACCURACY TOP1: {}% ({}/{})'.format(100*total_corr/len(analogies), total_corr, len(analogies)))
+        sum_total += len(analogies)
+        sum_total_corr += total_corr
+    print('Total accuracy: {}%  ({}/{})'.format(100*sum_total_corr/sum_total, sum_total_corr, sum_total))
+    print('{:.2f}s, cache {}'.format(time.perf_counter()-start, client.stats()))
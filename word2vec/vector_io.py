@@ -0,0 +1,164 @@
+'''
+Loading word vectors quickly.
+
+read_vectors in word_analogy.py parses the text file a line (and a float) at a time, which for multi GB embedding files
+takes longer than the evaluation. This module:
+- parses the text format in one numpy call (and skips a word2vec "vocab_size dim" header line if there is one)
+- reads the word2vec binary format (header line, then for each word: the word, a space and dim float32s)
+- caches the parsed matrix as a .npy file next to the vector file (plus a .vocab file of words, one per line). Later runs
+memory map the .npy instead of parsing, so start up is near instant and several evaluator processes reading the same
+cache share the same physical pages.
+
+Cache files for vectors.txt: vectors.txt.text.cache.npy (vectors.txt.text.norm.cache.npy when normalised, .bin. instead
+of .text. when read as binary) and vectors.txt.text.cache.vocab. With cache_dir they go in that directory instead.
+The .vocab file starts with the path, mtime and size of the vector file and the binary flag, and the cache is only used
+if they all still match. If the cache can't be written (e.g. a read only corpus directory) the vectors are just used
+from memory.
+'''
+
+import os
+import sys
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+
+
+def read_text_vectors(input_file):
+    '''
+    :param input_file: a word vector file of format word v1 v2 v3, one word vector per line
+    :return: list of words, 2D numpy array of vectors
+    '''
+    words, vector_lines = [], []
+    with open(input_file, 'r') as infile:
+        for line_num, line in enumerate(infile):
+            tokens = line.split(maxsplit=1)
+            if len(tokens) < 2:
+                continue
+            if line_num == 0 and all(token.isdigit() for token in line.split()):
+                continue #word2vec text header: vocab_size dim
+            words.append(tokens[0])
+            vector_lines.append(tokens[1])
+    try:
+        vec_array = np.loadtxt(vector_lines, dtype=np.float64, ndmin=2)
+    except ValueError:
+        sys.exit('Vectors are not all of same shape. There is an error in {}'.format(input_file))
+    return words, vec_array
+
+
+def read_binary_vectors(input_file):
+    '''
+    :param input_file: a word2vec binary file: a "vocab_size dim" line, then each word, a space and dim float32s
+    :return: list of words, 2D numpy array of vectors (float32, as stored)
+    '''
+    with open(input_file, 'rb') as infile:
+        vocab_size, vec_length = map(int, infile.readline().split())
+        data = infile.read()
+    words = []
+    vec_array = np.empty((vocab_size, vec_length), dtype=np.float32)
+    vec_bytes = 4*vec_length
+    position = 0
+    for row in range(vocab_size):
+        space = data.index(b' ', position)
+        #some writers put a newline after each vector, which ends up at the start of the next word
+        words.append(data[position:space].lstrip(b'\n').decode('utf-8', errors='replace'))
+        vec_array[row] = np.frombuffer(data, dtype='<f4', count=vec_length, offset=space+1)
+        position = space+1+vec_bytes
+    return words, vec_array
+
+
+def normalise(vec_array):
+    #divides each vector by its length. Like read_vectors, a zero vector becomes nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return vec_array / ((vec_array**2).sum(axis=1)**.5)[:, None]
+
+
+def cache_paths(input_file, norm_flag, binary, cache_dir=None):
+    '''
+    :param cache_dir: where to put the cache files. If None, next to input_file. In a shared directory the names
+    include a hash of the absolute path of input_file, so vector files with the same name don't share a cache
+    :return: paths of the matrix (.npy) and vocabulary cache files
+    '''
+    if cache_dir is None:
+        prefix = input_file
+    else:
+        path_hash = hashlib.sha256(os.path.abspath(input_file).encode('utf-8')).hexdigest()[:16]
+        prefix = os.path.join(cache_dir, '{}.{}'.format(os.path.basename(input_file), path_hash))
+    prefix += '.{}{}cache'.format('bin.' if binary else 'text.', 'norm.' if norm_flag else '')
+    return prefix + '.npy', prefix + '.vocab'
+
+
+def source_key(input_file, binary):
+    #what the cache was made from: it is only used if the vector file still has the same mtime and size
+    stat = os.stat(input_file)
+    return '#vector_io cache of {} mtime_ns {} size {} binary {}'.format(
+        os.path.abspath(input_file), stat.st_mtime_ns, stat.st_size, int(bool(binary)))
+
+
+def cache_is_fresh(input_file, norm_flag, binary, cache_dir=None):
+    matrix_file, vocab_file = cache_paths(input_file, norm_flag, binary, cache_dir)
+    if not (os.path.exists(matrix_file) and os.path.exists(vocab_file)):
+        return False
+    with open(vocab_file, 'r', encoding='utf-8') as infile:
+        return infile.readline().rstrip('\n') == source_key(input_file, binary)
+
+
+def write_cache(input_file, norm_flag, binary, words, vec_array, cache_dir=None):
+    '''
+    Write then rename, so a process that starts while the cache is being written never maps half a file.
+    The first line of the vocabulary file is the source_key, the words follow one per line.
+    :return: whether the cache was written. It isn't if the directory is read only (or full), and then the caller
+    just keeps the arrays it has
+    '''
+    matrix_file, vocab_file = cache_paths(input_file, norm_flag, binary, cache_dir)
+    temp_suffix = '.{}.tmp'.format(os.getpid())
+    temp_files = [matrix_file + temp_suffix + '.npy', vocab_file + temp_suffix]
+    try:
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        np.save(temp_files[0], vec_array)
+        with open(temp_files[1], 'w', encoding='utf-8') as outfile:
+            outfile.write(source_key(input_file, binary) + '\n')
+            outfile.write('\n'.join(words) + '\n')
+        os.replace(temp_files[0], matrix_file)
+        os.replace(temp_files[1], vocab_file)
+    except OSError as error:
+        print('Not caching {}: {}'.format(input_file, error), file=sys.stderr)
+        for temp_file in temp_files:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        return False
+    return True
+
+
+def read_cache(input_file, norm_flag, binary, cache_dir=None):
+    matrix_file, vocab_file = cache_paths(input_file, norm_flag, binary, cache_dir)
+    with open(vocab_file, 'r', encoding='utf-8') as infile:
+        words = infile.read().split('\n')[1:-1]
+    return words, np.load(matrix_file, mmap_mode='r')
+
+
+def load_vectors(input_file, norm_flag, binary=None, use_cache=True, cache_dir=None):
+    '''
+    Drop in replacement for word_analogy.read_vectors.
+    :param input_file: a text or word2vec binary vector file
+    :param norm_flag: an int to determine whether to normalise vectors
+    :param binary: whether input_file is in binary format. If None, files ending in .bin are binary
+    :param use_cache: memory map a .npy cache if there is one, and write one if there isn't
+    :param cache_dir: directory for the cache files (see cache_paths). If None, they go next to input_file
+    :return: dict of word to index mapping, default dict of index to word, array of vectors, vector length
+    '''
+    if binary is None:
+        binary = input_file.endswith('.bin')
+    if use_cache and cache_is_fresh(input_file, norm_flag, binary, cache_dir):
+        words, vec_array = read_cache(input_file, norm_flag, binary, cache_dir)
+    else:
+        words, vec_array = read_binary_vectors(input_file) if binary else read_text_vectors(input_file)
+        if norm_flag:
+            vec_array = normalise(vec_array)
+        if use_cache and write_cache(input_file, norm_flag, binary, words, vec_array, cache_dir):
+            words, vec_array = read_cache(input_file, norm_flag, binary, cache_dir)
+    #as in read_vectors, a repeated word maps to its last vector
+    word2index = {word: index for index, word in enumerate(words)}
+    index2word = defaultdict(str, enumerate(words))
+    return word2index, index2word, vec_array, vec_array.shape[1]
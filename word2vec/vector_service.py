@@ -0,0 +1,219 @@
+'''
+A long lived local service that keeps the word vectors in memory and answers similarity queries, so other tools don't
+have to run word_analogy.py (and load the vectors again) every time.
+
+Command to run: vector_service.py vector_file normalise similarity [--port PORT] [--cache-size N] [--dtype TYPE]
+[--max-mem MB] [--binary] [--no-cache] [--cache-dir DIR]
+
+Listens on localhost only. Requests are POSTed as JSON and each one carries a batch of queries, which are solved
+together with word_analogy.rank_analogies (one matrix multiply per chunk, like the analogy evaluation):
+
+/neighbours {"words": [w, ...], "k": 10} -> {"results": [[[word, score], ...] or null, ...]}
+    the k nearest words to each word (not counting itself). null for OOV words
+/analogy {"analogies": [[a, b, c], ...], "k": 1, "exclude": true} -> {"results": [[[word, score], ...], ...]}
+    the k best d for each a:b is like c:d. OOV words are zero vectors, as in word_analogy.py
+/similarity {"pairs": [[w1, w2], ...]} -> {"results": [score or null, ...]}
+GET /stats -> {"hits": .., "misses": .., "size": ..} of the result cache
+
+score is the cosine similarity if similarity is non-zero, else the (negated) Euclidean distance, so higher is always
+closer. Each query's answer is kept in an LRU cache (keyed on the query and k), so repeated queries skip the vocabulary
+scan; only the misses of a batch are solved. vector_client.py is a client for it.
+'''
+
+import json
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from vector_io import load_vectors
+from quantize import QuantizedVectors, DTYPES
+from word_analogy import row_norms, query_matrix, rank_analogies
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+class VectorService:
+    def __init__(self, word2index, index2word, vec_array, sim, max_bytes=2**29, cache_size=100000):
+        '''
+        :param vec_array: a numpy array of vectors or a QuantizedVectors
+        :param sim: a flag that if 0 uses Euclidean similarity, if >0 uses cosine
+        :param cache_size: number of query results kept in the LRU cache (0 turns it off)
+        '''
+        self.word2index, self.index2word = word2index, index2word
+        self.vec_array = vec_array
+        self.vec_norms = row_norms(vec_array)
+        self.sim = sim
+        self.max_bytes = max_bytes
+        self.cache = LRUCache(cache_size)
+
+    def scores(self, queries, indices):
+        #the score of each query against its own row of vector indices, higher is closer
+        vectors = self.vec_array[indices.ravel()].reshape(indices.shape + (-1,))
+        dots = np.einsum('qd,qkd->qk', queries, vectors)
+        query_norms = row_norms(queries)[:, None]
+        if self.sim:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.nan_to_num(dots / (query_norms*self.vec_norms[indices]), nan=0.0)
+        return -np.sqrt(np.maximum(query_norms**2 - 2*dots + self.vec_norms[indices]**2, 0))
+
+    def ranked(self, queries, k, exclude):
+        #[[word, score], ...] for each query, best first
+        win_indices = rank_analogies(queries, self.vec_array, self.vec_norms, self.sim, self.max_bytes, k, exclude)
+        win_scores = self.scores(queries, win_indices)
+        return [[[self.index2word[index], float(score)] for index, score in zip(row, row_scores)]
+                for row, row_scores in zip(win_indices, win_scores)]
+
+    def cached_batch(self, keys, solve):
+        '''
+        :param keys: cache key of each query in the batch
+        :param solve: function of the list of positions of the uncached queries, returning their results
+        :return: list of results, one per key
+        '''
+        results = [self.cache.get(key) for key in keys]
+        missing = [position for position, result in enumerate(results) if result is None]
+        if missing:
+            for position, result in zip(missing, solve(missing)):
+                results[position] = result
+                self.cache.put(keys[position], result)
+        return results
+
+    def neighbours(self, words, k=10):
+        in_vocab = [word for word in words if word in self.word2index]
+
+        def solve(positions):
+            indices = np.array([self.word2index[in_vocab[position]] for position in positions], dtype=np.int64)
+            queries = np.asarray(self.vec_array[indices], dtype=np.float64)
+            return self.ranked(queries, k, indices[:, None])
+
+        found = dict(zip(in_vocab, self.cached_batch([('neighbours', word, k) for word in in_vocab], solve)))
+        return [found.get(word) for word in words]
+
+    def analogy(self, analogies, k=1, exclude=True):
+        analogies = [tuple(analogy[:3]) for analogy in analogies]
+
+        def solve(positions):
+            batch = [analogies[position] for position in positions]
+            queries = query_matrix(batch, self.word2index, self.vec_array)
+            exclude_indices = None
+            if exclude:
+                exclude_indices = np.array([[self.word2index.get(word, -1) for word in analogy] for analogy in batch],
+                                           dtype=np.int64)
+            return self.ranked(queries, k, exclude_indices)
+
+        return self.cached_batch([('analogy', analogy, k, bool(exclude)) for analogy in analogies], solve)
+
+    def similarity(self, pairs):
+        results = [None]*len(pairs)
+        known = [position for position, (word1, word2) in enumerate(pairs)
+                 if word1 in self.word2index and word2 in self.word2index]
+        if known:
+            first = np.array([self.word2index[pairs[position][0]] for position in known], dtype=np.int64)
+            second = np.array([self.word2index[pairs[position][1]] for position in known], dtype=np.int64)
+            queries = np.asarray(self.vec_array[first], dtype=np.float64)
+            for position, score in zip(known, self.scores(queries, second[:, None])[:, 0]):
+                results[position] = float(score)
+        return results
+
+
+def make_handler(service):
+    class VectorRequestHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self.send_json(200, service.cache.stats())
+            else:
+                self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path == '/neighbours':
+                    results = service.neighbours(request['words'], int(request.get('k', 10)))
+                elif self.path == '/analogy':
+                    results = service.analogy(request['analogies'], int(request.get('k', 1)),
+                                              request.get('exclude', True))
+                elif self.path == '/similarity':
+                    results = service.similarity(request['pairs'])
+                else:
+                    self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+                    return
+            except (ValueError, KeyError, TypeError) as error:
+                self.send_json(400, {'error': '{}: {}'.format(type(error).__name__, error)})
+                return
+            self.send_json(200, {'results': results})
+
+        def log_message(self, format, *args):
+            pass #no line on stderr per request
+
+    return VectorRequestHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local word vector similarity service')
+    parser.add_argument('vector_file')
+    parser.add_argument('normalise', type=int, help='if non-zero, normalise word embedding vectors first')
+    parser.add_argument('similarity', type=int, help='if non-zero, use cosine. else use Euclidean')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=100000, help='number of query results to cache')
+    parser.add_argument('--dtype', choices=DTYPES, default='float64',
+                        help='type to store the vectors as for scoring (int8 has a scale per vector)')
+    parser.add_argument('--max-mem', type=int, default=512,
+                        help='MB of memory to use for the (queries x vocabulary) score matrix at once')
+    parser.add_argument('--binary', action='store_true',
+                        help='vector_file is in word2vec binary format (assumed anyway if it ends in .bin)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the memory mapped .npy cache of the vectors (see vector_io.py)")
+    parser.add_argument('--cache-dir', help='put the .npy cache in this directory instead of next to vector_file')
+    args = parser.parse_args()
+
+    word2index, index2word, vec_array, vec_length = load_vectors(args.vector_file, args.normalise,
+                                                                 args.binary or None, not args.no_cache,
+                                                                 args.cache_dir)
+    if args.dtype != 'float64':
+        vec_array = QuantizedVectors(vec_array, args.dtype)
+    service = VectorService(word2index, index2word, vec_array, args.similarity, args.max_mem*2**20, args.cache_size)
+    #one request at a time: a batch already uses all cores in the matrix multiply
+    server = HTTPServer(('127.0.0.1', args.port), make_handler(service))
+    print('Serving {} vectors on http://127.0.0.1:{}'.format(len(word2index), args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -1,6 +1,16 @@
 '''
 A script that takes 3 args and implements a word analogizer for word embeddings
-Command to run: word_analogy.py vector_file input_dir output_dir normalise similarity
+Command to run: word_analogy.py vector_file input_dir output_dir normalise similarity [--max-mem MB] [--top-k K]
+[--exclude] [--dtype TYPE] [--procs N] [--binary] [--no-cache] [--cache-dir DIR]
+
+--top-k K writes the K best words for each analogy (best first) and reports ACCURACY TOPK as well as TOP1.
+--exclude stops A, B and C from being the answer (they are often the nearest words to x_d).
+--dtype float32|float16|int8 stores the vectors in a smaller type for scoring (see quantize.py and quant_report.py).
+--procs N evaluates the files in a pool of N processes attached to one shared memory copy of the vectors
+(shared_vectors.py). Each worker writes its own output files and the accuracies are printed in the usual order.
+
+The vectors are loaded with vector_io.load_vectors, which also reads word2vec binary files and memory maps a .npy cache
+of the parsed vectors on later runs. read_vectors below is the original (slow) text reader.
 
 normalise: if non-zero, normalise word embedding vecotrs first. Else use original vectors.
 similarity: if non-zero, use cosine. else use Euclidean
@@ -24,13 +34,22 @@ instead of one value at at time.
 
 Like Example 5
 http://scipy.github.io/old-wiki/pages/EricsBroadcastingDoc
+
+Later: even that is one pass over the whole vocabulary per analogy (and the norms of every vector were recomputed for
+each one). Now the norms are computed once, all the analogies in a file are stacked into one (queries x dim) matrix and
+solved with a matrix multiply, in chunks so the score matrix stays under --max-mem.
 '''
 
 import sys
 import os
+import argparse
+from multiprocessing import Pool
 import numpy as np
 from collections import defaultdict
 
+from vector_io import load_vectors
+from quantize import QuantizedVectors, DTYPES
+
 
 def read_vectors(input_file, norm_flag):
     '''
@@ -46,7 +65,7 @@ def read_vectors(input_file, norm_flag):
     current_index = 0
     vec_array = []
     first = True
-    with open(input_file, 'rU') as infile:
+    with open(input_file, 'r') as infile:
         for line in infile:
             tokens = line.strip().split()
             #in our example all the vector sizes are 50, but I am not sure that is given so allow to be anything.
@@ -75,11 +94,14 @@ def read_vectors(input_file, norm_flag):
     return word2index, index2word, vec_array_np, vec_length
 
 
-def cosine_sim(x_d, vec_array):
+def cosine_sim(x_d, vec_array, vec_norms=None):
     #take dot product of 2 vectors. which reduces dimensionality and gives me an array of results.
     #IMPORTANT that vec_array is first arg as a result
+    #vec_norms can be passed in (see row_norms) so they are not recomputed over the whole array for every query
     dot_prod_array = np.dot(vec_array, x_d)
-    len_vec_array, len_x_d = (vec_array**2).sum(axis=1)**.5, (x_d**2).sum()**.5
+    if vec_norms is None:
+        vec_norms = row_norms(vec_array)
+    len_vec_array, len_x_d = vec_norms, (x_d**2).sum()**.5
     cosine_sim_array = np.divide(dot_prod_array, len_vec_array*len_x_d)
     best_vec_index = np.argmax(cosine_sim_array)
 
@@ -99,10 +121,146 @@ def euclidean_dist(x_d, vec_array):
     return best_vec_index
 
 
-def compute_analogies(word2index, index2word, vec_array, vec_length, input_dir, output_dir, sim):
+def row_norms(vec_array):
+    if isinstance(vec_array, QuantizedVectors):
+        return vec_array.norms
+    return (vec_array**2).sum(axis=1)**.5
+
+
+def vector_scores(queries, vec_array):
+    #(queries x vocab) dot products. vec_array is a numpy array or a QuantizedVectors
+    if isinstance(vec_array, QuantizedVectors):
+        return vec_array.scores(queries)
+    return np.dot(queries, vec_array.T)
+
+
+def read_analogies(input_file):
+    '''
+    :param input_file: file of analogies A B C D, one per line
+    :return: list of (A, B, C, D) tuples
+    '''
+    with open(input_file, 'r') as infile:
+        return [tuple(line.split()) for line in infile if line.strip()]
+
+
+def query_word_indices(analogies, word2index):
+    #(num analogies x 3) array of the indices of A, B and C. -1 for OOV words
+    return np.array([[word2index.get(word, -1) for word in analogy[:3]] for analogy in analogies],
+                    dtype=np.int64).reshape(-1, 3)
+
+
+def query_matrix(analogies, word2index, vec_array):
+    '''
+    Stacks the target vector x_d = x_b - x_a + x_c of every analogy into one matrix. OOV words are zero vectors.
+    :return: 2D numpy array of (num analogies x vector length)
+    '''
+    word_indices = query_word_indices(analogies, word2index)
+    queries = np.zeros((len(analogies), vec_array.shape[1]))
+    for column, sign in ((0, -1), (1, 1), (2, 1)):
+        indices = word_indices[:, column]
+        in_vocab = indices >= 0
+        queries[in_vocab] += sign*vec_array[indices[in_vocab]]
+    return queries
+
+
+def rank_analogies(queries, vec_array, vec_norms, sim, max_bytes, k=1, exclude=None):
+    '''
+    Finds the k best words for every query at once. The similarities of a chunk of queries against the whole
+    vocabulary are one matrix multiply, with the chunk size chosen so the (chunk x vocab) score matrix fits in
+    max_bytes. Euclidean distance uses |x-v|^2 = |x|^2 - 2x.v + |v|^2, so it is the same matrix multiply.
+    :param queries: 2D numpy array of target vectors, one per row
+    :param vec_norms: the row norms of vec_array, computed once (row_norms)
+    :param sim: a flag that if 0 uses Euclidean similarity, if >0 uses cosine
+    :param max_bytes: memory cap for the score matrix of one chunk
+    :param k: number of best words to return per query
+    :param exclude: optional (queries x n) array of vector indices that can't be returned for each query (the query
+    words A, B and C, which are often the nearest). -1 entries are ignored
+    :return: 2D numpy array (queries x k) of the indices of the winning vectors, best first
+    '''
+    num_queries = queries.shape[0]
+    k = min(k, vec_array.shape[0])
+    chunk_size = max(1, int(max_bytes // (8*vec_array.shape[0])))
+    winners = np.zeros((num_queries, k), dtype=np.int64)
+    for start in range(0, num_queries, chunk_size):
+        chunk = queries[start:start+chunk_size]
+        #scores where higher is better for both metrics
+        scores = vector_scores(chunk, vec_array)
+        query_norms = row_norms(chunk)
+        if sim:  # use cosine similarity
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores /= query_norms[:, None]*vec_norms[None, :]
+        else:
+            # use Euclidean distance, negated. The sqrt doesn't change the order so it is left out
+            scores *= 2
+            scores -= vec_norms[None, :]**2
+            scores -= query_norms[:, None]**2
+        #zero vectors give nan (cosine); they should never win
+        np.nan_to_num(scores, copy=False, nan=-np.inf)
+        if exclude is not None:
+            excluded = exclude[start:start+chunk_size]
+            rows, columns = np.nonzero(excluded >= 0)
+            scores[rows, excluded[rows, columns]] = -np.inf
+        if k == 1:
+            winners[start:start+chunk_size, 0] = np.argmax(scores, axis=1)
+        else:
+            top = np.argpartition(-scores, k-1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+            winners[start:start+chunk_size] = np.take_along_axis(top, order, axis=1)
+    return winners
+
+
+def solve_analogies(queries, vec_array, vec_norms, sim, max_bytes):
+    #the single best word for every query (see rank_analogies)
+    return rank_analogies(queries, vec_array, vec_norms, sim, max_bytes)[:, 0]
+
+
+def evaluate_file(filename, word2index, index2word, vec_array, vec_norms, input_dir, output_dir, sim, max_bytes,
+                  top_k=1, exclude=False):
+    '''
+    Solves all the analogies in one file and writes the output file (see compute_analogies for the params).
+    :return: filename, number of analogies, number correct, number correct in the top_k
+    '''
+    analogies = read_analogies(os.path.join(input_dir, filename))
+    queries = query_matrix(analogies, word2index, vec_array)
+    exclude_indices = query_word_indices(analogies, word2index) if exclude else None
+    win_indices = rank_analogies(queries, vec_array, vec_norms, sim, max_bytes, top_k, exclude_indices)
+    output_lines = []
+    total, total_corr, total_corr_k = 0, 0, 0
+    for (w_a, w_b, w_c, w_d), ranked_indices in zip(analogies, win_indices):
+        ranked = [index2word[win_index] for win_index in ranked_indices]
+        #update totals
+        total += 1
+        if ranked[0] == w_d:
+            total_corr += 1
+        if w_d in ranked:
+            total_corr_k += 1
+        output_lines.append('{} {} {} {}'.format(w_a, w_b, w_c, ' '.join(ranked)))
+    #write to output dir
+    with open(os.path.join(output_dir, filename), 'w') as outfile:
+        outfile.write('\n'.join(output_lines))
+    return filename, total, total_corr, total_corr_k
+
+
+#each pool worker attaches to the shared vectors once, in the initializer
+worker_data = {}
+
+def init_worker(vectors_spec, word2index, index2word, settings):
+    from shared_vectors import attach_vectors
+    worker_data['blocks'], worker_data['vec_array'], worker_data['vec_norms'] = attach_vectors(vectors_spec)
+    worker_data['word2index'], worker_data['index2word'] = word2index, index2word
+    worker_data['settings'] = settings
+
+def evaluate_file_worker(filename):
+    return evaluate_file(filename, worker_data['word2index'], worker_data['index2word'], worker_data['vec_array'],
+                         worker_data['vec_norms'], *worker_data['settings'])
+
+
+def compute_analogies(word2index, index2word, vec_array, vec_length, input_dir, output_dir, sim, max_bytes=2**29,
+                      top_k=1, exclude=False, procs=1):
     '''
     Computes a new target D for each given analogy A B C D. And compares the new D to the given D and prints out an
     accuracy to stdout.
+    All the analogies in a file are solved together with rank_analogies, and the vector norms are computed once.
     :param word2index: a dict of word to index mappings to retrieve vectors from the vector array for a given word
     :param index2word: the reverse, to retrieve the word after find the index of the best vector
     :param vec_array: a numpy array of vectors
@@ -110,66 +268,84 @@ def compute_analogies(word2index, index2word, vec_array, vec_length, input_dir,
     :param input_dir: directory of the input files
     :param output_dir: directory to write output files to (with the same name)
     :param sim: a flag that if 0 uses Euclidean similarity, if >0 uses cosine
+    :param max_bytes: memory cap for the score matrix computed at once (per process)
+    :param top_k: if > 1, output the top_k words for each analogy, best first, and also print ACCURACY TOP<top_k>
+    :param exclude: if True, A, B and C can't be the answer
+    :param procs: if > 1, files are evaluated in a pool of this many processes, which share one copy of the vectors
+    in shared memory. Accuracies are still printed in file order
     :return: none - writes all files to output dir and accuracy info to stdout
     '''
-    #initialise a zero vector for OOV words
-    zero_vec = np.zeros(vec_length)
     #files to process
     files = sorted(os.listdir(input_dir))
-    #files = ['capital-common-countries.txt']
-    sum_total, sum_total_corr = 0, 0
-    for filename in files:
-        output_lines = []
-        with open(os.path.join(input_dir, filename), 'rU') as infile:
-            total = 0
-            total_corr = 0
-            for line in infile:  # for every line find new D
-                if line:  # grab A, B, C words and convert to indexes with dict
-                    w_a, w_b, w_c, w_d = line.strip().split()
-                    a_b_c_vec = []
-                    for word in w_a, w_b, w_c:
-                        index = word2index.get(word, -1)  # this handles OOV words
-                        if index >= 0:
-                            next_vec = vec_array[index]
-                        else:
-                            next_vec = zero_vec
-                        a_b_c_vec.append(next_vec)
-                    x_a, x_b, x_c = a_b_c_vec
-                    # calc the target vector
-                    x_d = x_b - x_a + x_c
-                    # find word closest to x_d vector
-                    if sim:  # use cosine similarity
-                        win_index = cosine_sim(x_d, vec_array)
-                    else:
-                        # use Euclidean distance
-                        win_index = euclidean_dist(x_d, vec_array)
-                    winner = index2word[win_index]
-                    #update totals
-                    total += 1
-                    if winner == w_d:
-                        total_corr += 1
-                    output_line = '{} {} {} {}'.format(w_a, w_b, w_c, winner)
-                    output_lines.append(output_line)
-        #print accuracy
-        print('{}:'.format(filename))
-        print('ACCURACY TOP1: {}% ({}/{})'.format(100*total_corr/total, total_corr, total))
-        #write to output dir
-        with open(os.path.join(output_dir, filename), 'w') as outfile:
-            outfile.write('\n'.join(output_lines))
-        sum_total += total
-        sum_total_corr += total_corr
+    settings = (input_dir, output_dir, sim, max_bytes, top_k, exclude)
+    blocks, pool = [], None
+    if procs > 1:
+        from shared_vectors import share_vectors
+        blocks, vectors_spec = share_vectors(vec_array)
+        pool = Pool(procs, init_worker, (vectors_spec, word2index, index2word, settings))
+        results = pool.imap(evaluate_file_worker, files)
+    else:
+        vec_norms = row_norms(vec_array)
+        results = (evaluate_file(filename, word2index, index2word, vec_array, vec_norms, *settings)
+                   for filename in files)
+    sum_total, sum_total_corr, sum_total_corr_k = 0, 0, 0
+    try:
+        for filename, total, total_corr, total_corr_k in results:
+            #print accuracy
+            print('{}:'.format(filename))
+            print('ACCURACY TOP1: {}% ({}/{})'.format(100*total_corr/total, total_corr, total))
+            if top_k > 1:
+                print('ACCURACY TOP{}: {}% ({}/{})'.format(top_k, 100*total_corr_k/total, total_corr_k, total))
+            sum_total += total
+            sum_total_corr += total_corr
+            sum_total_corr_k += total_corr_k
+    finally:
+        #every result has been read unless something failed, and then the files still queued shouldn't be evaluated
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        for block in blocks:
+            block.close()
+            block.unlink()
     print('Total accuracy: {}%  ({}/{})'.format(100*sum_total_corr/sum_total, sum_total_corr, sum_total))
+    if top_k > 1:
+        print('Total accuracy TOP{}: {}%  ({}/{})'.format(top_k, 100*sum_total_corr_k/sum_total, sum_total_corr_k,
+                                                          sum_total))
 
 
 if __name__ == "__main__":
-    vector_file, input_dir, output_dir = sys.argv[1], sys.argv[2], sys.argv[3]
-    norm, sim = int(sys.argv[4]), int(sys.argv[5])
+    parser = argparse.ArgumentParser(description='Word analogy evaluation for word embeddings')
+    parser.add_argument('vector_file')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('normalise', type=int, help='if non-zero, normalise word embedding vectors first')
+    parser.add_argument('similarity', type=int, help='if non-zero, use cosine. else use Euclidean')
+    parser.add_argument('--max-mem', type=int, default=512,
+                        help='MB of memory to use for the (queries x vocabulary) score matrix at once')
+    parser.add_argument('--top-k', type=int, default=1,
+                        help='write the top k words for each analogy and report ACCURACY TOP<k> as well as TOP1')
+    parser.add_argument('--exclude', action='store_true', help="don't allow A, B or C as the answer")
+    parser.add_argument('--dtype', choices=DTYPES, default='float64',
+                        help='type to store the vectors as for scoring (int8 has a scale per vector)')
+    parser.add_argument('--procs', type=int, default=1,
+                        help='evaluate the files in a pool of this many processes sharing one copy of the vectors')
+    parser.add_argument('--binary', action='store_true',
+                        help='vector_file is in word2vec binary format (assumed anyway if it ends in .bin)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the memory mapped .npy cache of the vectors (see vector_io.py)")
+    parser.add_argument('--cache-dir', help='put the .npy cache in this directory instead of next to vector_file')
+    args = parser.parse_args()
+    vector_file, input_dir, output_dir = args.vector_file, args.input_dir, args.output_dir
+    norm, sim = args.normalise, args.similarity
     #print('Normalise y/n: {}, Sim: {}. >0 is cosine similarity, 0 is Euclidean'.format(norm, sim))
 
     #check if output_dir exists, if not, create it
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    word2index, index2word, vec_array, vec_length = read_vectors(vector_file, norm)
-    compute_analogies(word2index, index2word, vec_array, vec_length, input_dir, output_dir, sim)
-
+    word2index, index2word, vec_array, vec_length = load_vectors(vector_file, norm, args.binary or None,
+                                                                 not args.no_cache, args.cache_dir)
+    if args.dtype != 'float64':
+        vec_array = QuantizedVectors(vec_array, args.dtype)
+    compute_analogies(word2index, index2word, vec_array, vec_length, input_dir, output_dir, sim, args.max_mem*2**20,
+                      args.top_k, args.exclude, args.procs)